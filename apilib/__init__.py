@@ -1,7 +1,15 @@
+from .cache import *
 from .exceptions import *
+from .idcipher import *
+from .jsonbackend import *
+from .jsonstream import *
 from .meta import *
 from .model import *
 from .service import *
 from .service_models import *
 from .validation import *
 from .validators import *
+
+import sys
+if sys.version_info >= (3, 5):
+    from .aio import *
@@ -0,0 +1,355 @@
+'''Asyncio versions of the service classes. Requires Python 3.5 or later.'''
+from __future__ import absolute_import
+import asyncio
+import collections
+import inspect
+import ssl
+import urllib.parse
+import weakref
+
+from . import exceptions
+from . import jsonbackend
+from . import service
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+class AsyncHttpResponse(object):
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+class _ConnectionClosed(ConnectionError):
+    pass
+
+class StreamsHttpTransport(object):
+    '''Sends the requests of AsyncRemoteServiceStubs with a minimal HTTP/1.1 client
+    built on asyncio streams, using only the standard library.
+
+    Connections are kept alive and reused. At most pool_maxsize idle connections are
+    kept per host, and if max_connections is set, requests to a host beyond that many
+    at once wait for a connection to be free. timeout is in seconds for the whole
+    request, None to wait forever. A transport must only be used from one event loop.
+    '''
+
+    def __init__(self, pool_maxsize=10, max_connections=None, timeout=None, ssl_context=None):
+        self.pool_maxsize = pool_maxsize
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        # (scheme, host, port) -> idle (reader, writer) pairs
+        self._idle = collections.defaultdict(collections.deque)
+        self._limits = {}
+
+    async def post(self, url, data, headers):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('Unsupported URL scheme "%s"' % parts.scheme)
+        default_port = 443 if parts.scheme == 'https' else 80
+        port = parts.port or default_port
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = [
+            'POST %s HTTP/1.1' % path,
+            'Host: %s' % (parts.hostname if port == default_port else '%s:%d' % (parts.hostname, port)),
+            'Content-Length: %d' % len(data),
+            'Connection: keep-alive',
+        ]
+        lines.extend('%s: %s' % header for header in headers.items())
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data
+
+        limit = self._get_limit(key)
+        if limit:
+            await limit.acquire()
+        try:
+            if self.timeout is None:
+                return await self._send(key, message)
+            return await asyncio.wait_for(self._send(key, message), self.timeout)
+        finally:
+            if limit:
+                limit.release()
+
+    async def close(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+    def _get_limit(self, key):
+        if self.max_connections is None:
+            return None
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(self.max_connections)
+        return limit
+
+    async def _send(self, key, message):
+        idle = self._idle[key]
+        while True:
+            reused = False
+            while idle and not reused:
+                reader, writer = idle.pop()
+                reused = not reader.at_eof()
+                if not reused:
+                    writer.close()
+            if not reused:
+                reader, writer = await self._connect(key)
+            try:
+                writer.write(message)
+                await writer.drain()
+                response, keep_alive = await self._read_response(reader)
+            except (_ConnectionClosed, ConnectionResetError, BrokenPipeError):
+                writer.close()
+                # The server may close an idle connection at any time. Nothing was
+                # read, so the request can safely be sent again on a new connection.
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive and len(idle) < self.pool_maxsize:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        ssl_context = None
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            ssl_context = self.ssl_context
+        return await asyncio.open_connection(host, port, ssl=ssl_context)
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise _ConnectionClosed('The connection was closed before a response was received')
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+        if status < 200 or status in (204, 304):
+            content = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = await self._read_chunked(reader)
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        else:
+            # The body runs until the server closes the connection
+            content = await reader.read()
+            keep_alive = False
+        return AsyncHttpResponse(status, content, headers), keep_alive
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int(((await reader.readline()).split(b';', 1)[0]).strip(), 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        # Skip any trailers
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        return b''.join(chunks)
+
+class AiohttpTransport(object):
+    '''Sends the requests of AsyncRemoteServiceStubs with an aiohttp ClientSession,
+    which is created on first use. At most max_connections connections are opened
+    at once. timeout is in seconds for the whole request, None to wait forever.'''
+
+    def __init__(self, max_connections=100, timeout=None):
+        if not aiohttp:
+            raise exceptions.ModuleRequired('You must install the aiohttp module in order to use AiohttpTransport')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = None
+
+    async def post(self, url, data, headers):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                # The session is shared by every stub using the transport
+                cookie_jar=aiohttp.DummyCookieJar())
+        async with self._session.post(url, data=data, headers=headers) as response:
+            return AsyncHttpResponse(response.status, await response.read(), response.headers)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+# Event loop -> the transport of stubs that aren't given one
+_default_transports = weakref.WeakKeyDictionary()
+
+def get_default_async_http_transport():
+    '''Returns the transport used by AsyncRemoteServiceStubs that aren't given one,
+    one per event loop: an AiohttpTransport if aiohttp is installed, otherwise a
+    StreamsHttpTransport. It should be closed with close_default_async_http_transport()
+    before the event loop is.'''
+    loop = asyncio.get_event_loop()
+    transport = _default_transports.get(loop)
+    if transport is None:
+        transport = _default_transports[loop] = AiohttpTransport() if aiohttp else StreamsHttpTransport()
+    return transport
+
+async def close_default_async_http_transport():
+    '''Closes the current event loop's default transport, if it was used. Stubs
+    calling get_default_async_http_transport() afterwards get a new one.'''
+    transport = _default_transports.pop(asyncio.get_event_loop(), None)
+    if transport is not None:
+        await transport.close()
+
+class AsyncRemoteServiceStub(service.RemoteServiceStub):
+    '''Like RemoteServiceStub, but its methods are coroutines.
+
+    Usage:
+    class RemoteFooService(FooService, apilib.AsyncRemoteServiceStub):
+        pass
+
+    service = RemoteFooService('https://remoteserver.com')
+    foo_response = await service.foo(FooRequest(...))
+
+    Pass a StreamsHttpTransport or AiohttpTransport, or any object with the same
+    post() coroutine, to configure connection pooling and timeouts.
+    '''
+
+    async def _invoke(self, method_descriptor, request):
+        json_backend = jsonbackend.get_json_backend(self.json_backend)
+        transport = self.transport or get_default_async_http_transport()
+        response = await transport.post(
+            self._method_url(method_descriptor), json_backend.dumps_bytes(request.to_json()), service._JSON_HEADERS)
+        return method_descriptor.response_class.from_json(json_backend.loads(response.content))
+
+class AsyncServiceImplementation(service.ServiceImplementation):
+    '''A ServiceImplementation whose methods may be coroutines, invoked with
+    ainvoke() and ainvoke_with_json(). Validation, ApiException handling,
+    process_unhandled_exception() and logging work as with invoke().
+
+    Usage:
+    class FooServiceImpl(FooService, apilib.AsyncServiceImplementation):
+        async def foo(self, foo_request):
+            return FooResponse(...)
+
+    response = await FooServiceImpl().ainvoke('foo', FooRequest(...))
+    '''
+
+    async def ainvoke(self, method_name, request, already_validated=False):
+        self.log_request(method_name, request)
+
+        method_descriptor = self.resolve_method(method_name)
+        method = getattr(self, method_descriptor.name)
+
+        validation_errors = None if already_validated else self._validate_request(method_name, request)
+        if validation_errors:
+            response = self._request_error_response(method_descriptor, validation_errors)
+        else:
+            try:
+                response = method(request)
+                if inspect.isawaitable(response):
+                    response = await response
+                response.response_code = service.ResponseCode.SUCCESS
+            except Exception as e:
+                response = self._exception_response(method_descriptor, e)
+                if response is None:
+                    raise
+
+        self.log_response(method_name, request, response)
+        return response
+
+    async def ainvoke_with_json(self, method_name, json_request):
+        method_descriptor, request, validation_errors = self._parse_request(method_name, json_request)
+        if validation_errors:
+            response = self._request_error_response(method_descriptor, validation_errors)
+        else:
+            response = await self.ainvoke(method_name, request, already_validated=True)
+        return response.to_json() if response else None
+
+class AsgiServiceApp(object):
+    '''An ASGI application serving AsyncServiceImplementations, for servers like uvicorn.
+    Each method is served at POST <service path>/<method name>, e.g. /foo_service/foo,
+    with the JSON request as the body, and responds with the JSON response.
+
+    Usage:
+    app = apilib.AsgiServiceApp([FooServiceImpl(), BarServiceImpl()])
+    '''
+
+    def __init__(self, services):
+        self._services = {}
+        for service_impl in services:
+            if not isinstance(service_impl, AsyncServiceImplementation):
+                raise exceptions.ConfigurationRequired('%s must be an AsyncServiceImplementation to be served' % type(service_impl).__name__)
+            if not service_impl.path:
+                raise exceptions.ConfigurationRequired('%s must have a path to be served' % type(service_impl).__name__)
+            self._services[service_impl.path.rstrip('/')] = service_impl
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type "%s"' % scope['type'])
+
+        service_path, _, method_name = scope['path'].rstrip('/').rpartition('/')
+        service_impl = self._services.get(service_path)
+        if service_impl is None or method_name not in service_impl.methods:
+            return await self._send_text(send, 404, 'Not Found')
+        if scope['method'] != 'POST':
+            return await self._send_text(send, 405, 'Method Not Allowed')
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        json_backend = jsonbackend.get_json_backend(service_impl.json_backend)
+        try:
+            json_request = json_backend.loads(b''.join(chunks))
+        except ValueError:
+            return await self._send_text(send, 400, 'Invalid JSON')
+        if not isinstance(json_request, dict):
+            return await self._send_text(send, 400, 'The request must be a JSON object')
+        try:
+            json_response = await service_impl.ainvoke_with_json(method_name, json_request)
+        except exceptions.MethodNotImplementedException:
+            return await self._send_text(send, 404, 'Not Found')
+        await self._send(send, 200, b'application/json', json_backend.dumps_bytes(json_response))
+
+    async def _send_text(self, send, status, text):
+        await self._send(send, status, b'text/plain; charset=utf-8', text.encode('utf-8'))
+
+    async def _send(self, send, status, content_type, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode('ascii'))],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+import collections
+import threading
+
+_missing = object()
+
+if hasattr(collections.OrderedDict, 'move_to_end'):
+    _move_to_end = collections.OrderedDict.move_to_end
+else:
+    def _move_to_end(data, key):
+        data[key] = data.pop(key)
+
+class LRUCache(object):
+    '''A thread-safe mapping that holds at most maxsize items, evicting the least
+    recently used item to make room. A maxsize of 0 disables the cache.'''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                # Re-inserting marks the item as the most recently used
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def get_many(self, keys, default=None):
+        '''Like get(), for a sequence of keys, taking the lock only once'''
+        with self._lock:
+            data = self._data
+            get = data.get
+            values = [get(key, _missing) for key in keys]
+            hits = 0
+            for i, value in enumerate(values):
+                if value is _missing:
+                    values[i] = default
+                else:
+                    _move_to_end(data, keys[i])
+                    hits += 1
+            self.hits += hits
+            self.misses += len(values) - hits
+            return values
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            if self.maxsize <= 0:
+                return
+            while len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+            self._data[key] = value
+
+    def put_many(self, items):
+        '''Like put(), for an iterable of (key, value) pairs'''
+        with self._lock:
+            for key, value in items:
+                self._data.pop(key, None)
+                if self.maxsize <= 0:
+                    continue
+                while len(self._data) >= self.maxsize:
+                    self._data.popitem(last=False)
+                self._data[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
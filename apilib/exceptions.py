@@ -27,9 +27,22 @@ class ModelLoadingError(ApilibException):
             '\n  '.join(str(e) for e in self.errors),
         )
 
+class ErrorLimitReached(ApilibException):
+    '''Raised by an ErrorContext created with max_errors once that many errors have been added.
+    Model.from_json and Model.validate stop at this point and report the errors collected so far.'''
+
+    def __init__(self, error_context):
+        super(ErrorLimitReached, self).__init__(
+            'Reached the limit of %s errors' % error_context.max_errors)
+        self.error_context = error_context
+
 class DeserializationError(ModelLoadingError):
     ERROR_NAME = 'DeserializationError'
 
+class StreamDeserializationError(DeserializationError):
+    '''Raised while iterating over a list field parsed lazily by Model.from_json_stream,
+    when an item can't be deserialized.'''
+
 class ValidationError(ModelLoadingError):
     ERROR_NAME = 'ValidationError'
 
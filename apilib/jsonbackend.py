@@ -0,0 +1,153 @@
+from __future__ import absolute_import
+import datetime
+import decimal
+import json
+
+import six
+
+from . import exceptions
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+def json_default(value):
+    '''Encodes the values that field types leave for the JSON library, the same way
+    the corresponding field types do, e.g. a Decimal inside an AnyPrimitive field.'''
+    if isinstance(value, decimal.Decimal):
+        return six.text_type(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return six.text_type(value.isoformat())
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
+
+class JsonBackend(object):
+    '''Encodes and decodes JSON text. dumps() returns text, loads() accepts text or bytes.'''
+
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError()
+
+    def loads(self, s):
+        raise NotImplementedError()
+
+    def dumps_bytes(self, obj):
+        return self.dumps(obj).encode('utf-8')
+
+class StdlibJsonBackend(JsonBackend):
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(default=json_default)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+    def loads(self, s):
+        if isinstance(s, bytes):
+            s = s.decode('utf-8')
+        return json.loads(s)
+
+class OrjsonBackend(JsonBackend):
+    name = 'orjson'
+
+    def __init__(self):
+        if not orjson:
+            raise exceptions.ModuleRequired('You must install the orjson module in order to use the orjson JSON backend')
+        # Datetimes go through json_default so they are formatted like DateTime fields
+        self._option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=json_default, option=self._option).decode('utf-8')
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=json_default, option=self._option)
+
+    def loads(self, s):
+        return orjson.loads(s)
+
+class SimplejsonBackend(JsonBackend):
+    name = 'simplejson'
+
+    def __init__(self):
+        if not simplejson:
+            raise exceptions.ModuleRequired('You must install the simplejson module in order to use the simplejson JSON backend')
+        # use_decimal=False so Decimals are encoded as strings, like Decimal fields
+        self._encoder = simplejson.JSONEncoder(default=json_default, use_decimal=False)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+    def loads(self, s):
+        return simplejson.loads(s)
+
+class UjsonBackend(JsonBackend):
+    name = 'ujson'
+
+    def __init__(self):
+        if not ujson:
+            raise exceptions.ModuleRequired('You must install the ujson module in order to use the ujson JSON backend')
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, default=json_default, ensure_ascii=False)
+
+    def loads(self, s):
+        return ujson.loads(s)
+
+_backend_classes = {}
+_backends = {}
+_default_backend_name = 'json'
+
+# The order in which 'auto' picks the first installed backend
+AUTO_JSON_BACKENDS = ('orjson', 'ujson', 'simplejson', 'json')
+
+def register_json_backend(backend_class):
+    _backend_classes[backend_class.name] = backend_class
+    _backends.pop(backend_class.name, None)
+
+def get_json_backend(name=None):
+    '''Returns the backend registered under name, or the process-wide default.
+    The name 'auto' selects the fastest installed backend.'''
+    name = name or _default_backend_name
+    backend = _backends.get(name)
+    if backend is None:
+        if name == 'auto':
+            backend = _get_auto_json_backend()
+        elif name in _backend_classes:
+            backend = _backend_classes[name]()
+        else:
+            raise exceptions.ConfigurationRequired('Unknown JSON backend "%s"' % name)
+        _backends[name] = backend
+    return backend
+
+def set_json_backend(name):
+    '''Sets the process-wide default JSON backend'''
+    global _default_backend_name
+    get_json_backend(name)
+    _default_backend_name = name
+
+def _get_auto_json_backend():
+    for name in AUTO_JSON_BACKENDS:
+        try:
+            return get_json_backend(name)
+        except exceptions.ModuleRequired:
+            pass
+    return get_json_backend('json')
+
+register_json_backend(StdlibJsonBackend)
+register_json_backend(OrjsonBackend)
+register_json_backend(SimplejsonBackend)
+register_json_backend(UjsonBackend)
@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+import codecs
+import io
+import json
+import re
+
+import six
+
+JSON_READ_SIZE = 64 * 1024
+
+_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+# Matches when everything after a decoded value could still be part of a number
+_NUMBER_TAIL_RE = re.compile(r'[0-9.eE+-]*\Z')
+
+class JsonStreamError(ValueError):
+    pass
+
+class JsonStreamReader(object):
+    '''Reads a JSON document from a file-like object a piece at a time, so that only
+    the value currently being read has to be held in memory. The source may also be
+    bytes or text. Byte streams are decoded as utf-8.
+
+    Usage:
+    reader = JsonStreamReader(fp)
+    for key in reader.iter_object():
+        if key == 'items':
+            for item in reader.iter_array():
+                ...
+        else:
+            value = reader.read_value()
+    reader.end()
+    '''
+
+    def __init__(self, source, read_size=JSON_READ_SIZE):
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        elif isinstance(source, six.text_type):
+            source = io.StringIO(source)
+        self._fp = source
+        self._read_size = read_size
+        self._decoder = json.JSONDecoder()
+        self._utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = u''
+        self._pos = 0
+        self._eof = False
+
+    def peek(self):
+        '''Returns the next non-whitespace character, or None at the end of the stream'''
+        self._skip_whitespace()
+        return self._buffer[self._pos] if self._pos < len(self._buffer) else None
+
+    def read_value(self):
+        '''Reads the next complete JSON value'''
+        self._skip_whitespace()
+        read_size = self._read_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                value, end = None, None
+            # A number that runs up to the end of the buffer, like "1." or "12",
+            # may continue in data that hasn't been read yet.
+            if end is not None and (self._eof or not _NUMBER_TAIL_RE.match(self._buffer, end)):
+                self._pos = end
+                return value
+            if not self._read(read_size):
+                if end is not None:
+                    self._pos = end
+                    return value
+                raise JsonStreamError('Invalid JSON value')
+            # Grow the reads so that a large value isn't re-parsed once per read_size
+            read_size *= 2
+
+    def iter_object(self):
+        '''Yields the keys of an object. The value of each key must be read,
+        with read_value() or iter_array(), before advancing to the next key.'''
+        self._expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, six.string_types):
+                raise JsonStreamError('Expected an object key, found %s' % json.dumps(key))
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def iter_array(self):
+        '''Yields the items of an array one at a time'''
+        self._expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self._expect(',]') == ']':
+                return
+
+    def end_object(self):
+        '''Finishes an object whose keys were being read with iter_object() and was
+        left after reading the value of what should have been its last key.'''
+        if self._expect(',}') != '}':
+            raise JsonStreamError('Expected the end of the object')
+
+    def end(self):
+        '''Checks that nothing but whitespace remains in the stream'''
+        if self.peek() is not None:
+            raise JsonStreamError('Unexpected data after the end of the JSON document')
+
+    def _expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise JsonStreamError('Expected one of "%s", found %s' % (
+                chars, '"%s"' % char if char is not None else 'the end of the stream'))
+        self._pos += 1
+        return char
+
+    def _skip_whitespace(self):
+        while True:
+            self._pos = _WHITESPACE_RE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer) or not self._read(self._read_size):
+                return
+
+    def _read(self, size):
+        # Appends more of the stream to the buffer, returning False at the end of the stream
+        if self._eof:
+            return False
+        data = self._fp.read(size)
+        if not data:
+            self._eof = True
+            if isinstance(data, bytes):
+                # Raises if the stream ended in the middle of a character
+                self._utf8_decoder.decode(data, final=True)
+            return False
+        if isinstance(data, bytes):
+            data = self._utf8_decoder.decode(data)
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
@@ -2,35 +2,183 @@ from __future__ import absolute_import
 import datetime
 import decimal
 import inspect
+import itertools
 import json
+import operator
 import re
 import threading
 
-from dateutil import parser as dateutil_parser
 import six
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 try:
     import hashids
 except ImportError:
     hashids = None
 
+try:
+    from dateutil import parser as dateutil_parser
+    from dateutil import tz as dateutil_tz
+except ImportError:
+    dateutil_parser = None
+    dateutil_tz = None
+
+from .cache import LRUCache
 from .validation import CommonErrorCodes
 from .validation import ErrorContext
 from . import exceptions
+from . import idcipher
+from . import jsonbackend
+from . import jsonstream
 from . import validators as vals
 
 ID_ENCRYPTION_KEY = None  # Set this to encrypt ids
+# How EncryptedId fields encode ids: 'hashids' (the default, requires the hashids
+# module) or 'feistel' (see idcipher.FeistelIdCipher).
+ID_ENCRYPTION_SCHEME = 'hashids'
+# Set to the previous scheme when switching schemes, to keep decoding the ids it
+# encoded. Strings that aren't valid ids of ID_ENCRYPTION_SCHEME are then decoded
+# with this scheme, so a few strings that were invalid before decode to an id.
+ID_DECRYPTION_FALLBACK_SCHEME = None
 ID_HASHER = None
+# The number of encoded and of decoded ids EncryptedId keeps in memory
+ID_CACHE_SIZE = 4096
+
+class IdCodec(object):
+    '''Encodes and decodes ids for EncryptedId fields with a given key, remembering
+    recently used ids in encode_cache and decode_cache.'''
+
+    def __init__(self, key, scheme='hashids', cache_size=None, fallback_scheme=None):
+        self.key = key
+        self.scheme = scheme
+        self.fallback_scheme = fallback_scheme
+        self.hasher = hashids.Hashids(salt=key, min_length=8) if hashids else None
+        self.cipher = idcipher.FeistelIdCipher(key)
+        schemes = {
+            'hashids': (self.hasher and self.hasher.encode, self._decode_hashid),
+            'feistel': (self.cipher.encode, self.cipher.decode),
+        }
+        # The configured scheme is always tried first
+        names = [scheme] if fallback_scheme in (None, scheme) else [scheme, fallback_scheme]
+        for name in names:
+            if name not in schemes:
+                raise exceptions.ConfigurationRequired('Unknown id encryption scheme "%s"' % name)
+            if name == 'hashids' and not self.hasher:
+                raise exceptions.ModuleRequired('You must install the hashids module in order to use EncryptedId fields')
+        self._encode = schemes[scheme][0]
+        self._decoders = [schemes[name][1] for name in names]
+        cache_size = ID_CACHE_SIZE if cache_size is None else cache_size
+        self.encode_cache = LRUCache(cache_size)
+        self.decode_cache = LRUCache(cache_size)
+
+    def encode(self, value):
+        encoded = self.encode_cache.get(value)
+        if encoded is None:
+            encoded = self._encode(value)
+            self.encode_cache.put(value, encoded)
+        return encoded
+
+    def encode_many(self, values):
+        '''Encodes a sequence of ids, none of which may be None'''
+        results = self.encode_cache.get_many(values)
+        encoded = {}
+        encode = self._encode
+        for i, result in enumerate(results):
+            if result is None:
+                value = values[i]
+                result = encoded.get(value)
+                if result is None:
+                    result = encoded[value] = encode(value)
+                results[i] = result
+        if encoded:
+            self.encode_cache.put_many(six.iteritems(encoded))
+        return results
+
+    def decode(self, value):
+        '''Returns the id encoded in value, or None if value is not a valid id'''
+        decoded = self.decode_cache.get(value)
+        if decoded is None:
+            decoded = self._decode(value)
+            if decoded is not None:
+                self.decode_cache.put(value, decoded)
+        return decoded
+
+    def decode_many(self, values):
+        '''Decodes a sequence of strings, with None in place of each invalid id'''
+        results = self.decode_cache.get_many(values)
+        decoded = {}
+        for i, result in enumerate(results):
+            if result is None:
+                value = values[i]
+                if value not in decoded:
+                    decoded[value] = self._decode(value)
+                results[i] = decoded[value]
+        if decoded:
+            self.decode_cache.put_many((k, v) for k, v in six.iteritems(decoded) if v is not None)
+        return results
+
+    def _decode(self, value):
+        for decode in self._decoders:
+            decoded = decode(value)
+            if decoded is not None:
+                return decoded
+        return None
 
-def _create_id_hasher():
-    global ID_HASHER
-    if not ID_ENCRYPTION_KEY:
-        raise exceptions.ConfigurationRequired('You must set apilib.ID_ENCRYPTION_KEY prior to using EncryptedId fields')
-    ID_HASHER = hashids.Hashids(salt=ID_ENCRYPTION_KEY, min_length=8)
+    def _decode_hashid(self, value):
+        # Unclear why this doesn't work with unicode values,
+        # must coerce it to be a string.
+        ids = self.hasher.decode(str(value))
+        if not ids or len(ids) > 1:
+            return None
+        return ids[0]
+
+_id_codec = None
+
+def get_id_codec():
+    '''Returns the codec for the current ID_ENCRYPTION_KEY, ID_ENCRYPTION_SCHEME and
+    ID_DECRYPTION_FALLBACK_SCHEME. Changing any of them replaces the codec, along with its caches.'''
+    global _id_codec, ID_HASHER
+    codec = _id_codec
+    if (codec is None or codec.key != ID_ENCRYPTION_KEY or codec.scheme != ID_ENCRYPTION_SCHEME
+            or codec.fallback_scheme != ID_DECRYPTION_FALLBACK_SCHEME):
+        if not ID_ENCRYPTION_KEY:
+            raise exceptions.ConfigurationRequired('You must set apilib.ID_ENCRYPTION_KEY prior to using EncryptedId fields')
+        codec = _id_codec = IdCodec(ID_ENCRYPTION_KEY, ID_ENCRYPTION_SCHEME, fallback_scheme=ID_DECRYPTION_FALLBACK_SCHEME)
+        ID_HASHER = codec.hasher
+    return codec
 
 _field_lock = threading.Lock()
 
-class Model(object):
+# The approximate size of the chunks yielded by Model.iter_json()
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+
+# to_string() shows at most this many items of each list and dict field, None for all
+TO_STRING_MAX_ITEMS = 100
+
+# Shown by to_string() and iter_json() in place of a list field that holds an iterator
+STREAMED_LIST_PLACEHOLDER = '<streamed>'
+
+# The number of (service, method, operator) triples for which each model class
+# caches its active validators. The operator comes from the request, so the least
+# recently used triples are evicted rather than letting unknown operators fill the cache.
+MAX_CACHED_VALIDATOR_CONTEXTS = 256
+
+class BaseModel(object):
+    '''The base of Model and CompactModel, which differ only in how instances
+    store their field values. Extend one of them rather than this class.'''
+
+    __slots__ = ()
+
+    # Set to True to keep the hash of each instance once computed, e.g. for models
+    # that are put in sets or used as dict keys repeatedly. The cached hash is
+    # cleared whenever a field is assigned, but not when a list, dict or nested
+    # model held by a field is modified in place.
+    cache_fingerprint = False
+
     def __init__(self, **kwargs):
         self._data = {}
         self._populate_fields()
@@ -39,12 +187,20 @@ class Model(object):
                 raise exceptions.UnknownFieldException('Unknown field "%s"' % key)
             setattr(self, key, value)
 
-    def validate(self, error_context=None, context=None):
+    def validate(self, error_context=None, context=None, max_errors=None):
         is_root = not error_context
-        error_context = error_context or ErrorContext()
-        context = self.make_parent_context(self.to_dict(), context) if context else None
-        for field_name, field in six.iteritems(self._field_name_to_field):
-            field._validate(getattr(self, field_name), error_context.extend(field=field_name), context)
+        error_context = error_context or ErrorContext(max_errors=max_errors)
+        if context and self._get_validated_fields():
+            context = self.make_parent_context(_LazyModelDict(self), context)
+            active_validators = self._get_active_validators(context)
+        else:
+            active_validators = {}
+        try:
+            for field_name, (field, validators) in six.iteritems(active_validators):
+                field._validate(getattr(self, field_name), error_context.extend(field=field_name), context, validators)
+        except exceptions.ErrorLimitReached as e:
+            if e.error_context is not error_context:
+                raise
 
         if error_context.has_errors():
             if is_root:
@@ -54,43 +210,91 @@ class Model(object):
         return self
 
     def to_dict(self):
-        return {key: self._field_name_to_field[key].to_json(value) for key, value in six.iteritems(self._data)}
+        return self._get_to_dict_plan()(self)
 
     # Deprecated. Use to_dict(), which is a better name.
     def to_json(self):
         return self.to_dict()
 
-    def to_json_str(self):
-        return json.dumps(self.to_json())
-
+    # json_backend is the name of a registered JSON backend, see jsonbackend.py.
+    # By default the process-wide backend is used.
+    def to_json_str(self, json_backend=None):
+        return jsonbackend.get_json_backend(json_backend).dumps(self.to_json())
+
+    def to_json_bytes(self):
+        '''Returns the utf-8 encoded JSON for this model, the same as
+        json.dumps(to_json()), encoding field values directly instead of
+        building the intermediate dict tree.'''
+        if not _uses_default_to_dict(type(self)):
+            return _json_encoder.encode(self.to_json()).encode('utf-8')
+        return self._get_json_encoder_plan()(self).encode('utf-8')
+
+    def iter_json(self, chunk_size=None):
+        '''Yields the same JSON text as json.dumps(to_json()) in chunks of roughly
+        chunk_size characters, without building the whole dict or string in memory.
+        A list field holding an iterator is written as STREAMED_LIST_PLACEHOLDER.'''
+        return _iter_json_chunks(_iter_model_json(self), chunk_size or JSON_STREAM_CHUNK_SIZE)
+
+    def write_json(self, fp, chunk_size=None):
+        for chunk in self.iter_json(chunk_size):
+            fp.write(chunk)
+
+    # Pass max_errors to stop parsing as soon as that many errors have been found.
     @classmethod
-    def from_json(cls, obj, error_context=None, context=None):
+    def from_json(cls, obj, error_context=None, context=None, max_errors=None):
         cls._populate_fields()
         if obj is None:
             return None
 
-        kwargs = {}
         is_root = not error_context
-        error_context = error_context or ErrorContext()
-        context = cls.make_parent_context(obj, context) if context else None
-        for key, field in six.iteritems(cls._field_name_to_field):
-            kwargs[key] = field.from_json(obj.get(key), error_context.extend(field=key), context)
-        for key in six.iterkeys(obj):
-            if key not in cls._field_name_to_field:
-                error_context.extend(field=key).add_error(CommonErrorCodes.UNKNOWN_FIELD, 'Unknown field "%s"' % key)
-        if error_context.has_errors():
-            if is_root:
-                raise exceptions.DeserializationError(error_context.all_errors())
-            return None
-        return cls(**kwargs)
+        error_context = error_context or ErrorContext(max_errors=max_errors)
+        context = cls.make_parent_context(obj, context) if context and cls._requires_context() else None
+        try:
+            instance = cls._get_from_json_plan()(obj, error_context, context)
+        except exceptions.ErrorLimitReached as e:
+            # Only the call that owns the limited context stops here,
+            # nested models let it propagate.
+            if e.error_context is not error_context:
+                raise
+            instance = None
+        if instance is None and is_root:
+            raise exceptions.DeserializationError(error_context.all_errors())
+        return instance
 
     @classmethod
     def make_parent_context(cls, obj, context):
         return context.for_parent(obj)
 
     @classmethod
-    def from_json_str(cls, json_str):
-        return cls.from_json(json.loads(json_str))
+    def from_json_str(cls, json_str, max_errors=None, json_backend=None):
+        return cls.from_json(jsonbackend.get_json_backend(json_backend).loads(json_str), max_errors=max_errors)
+
+    # Parses JSON from a file-like object, bytes or text without loading the whole
+    # document first. Lists of models are converted to models item by item. If
+    # iter_field names a list field, that field must be the last key of the object
+    # and is set to an iterator that parses its items as they are consumed, raising
+    # StreamDeserializationError for an invalid item. Its own validators are not run,
+    # and validators of other fields that read it only see its first item.
+    @classmethod
+    def from_json_stream(cls, fp, error_context=None, context=None, max_errors=None, iter_field=None):
+        cls._populate_fields()
+        reader = jsonstream.JsonStreamReader(fp)
+        if reader.peek() != '{':
+            obj = reader.read_value()
+            reader.end()
+            return cls.from_json(obj, error_context, context, max_errors)
+
+        is_root = not error_context
+        error_context = error_context or ErrorContext(max_errors=max_errors)
+        try:
+            instance = _from_json_stream(cls, reader, error_context, context, iter_field)
+        except exceptions.ErrorLimitReached as e:
+            if e.error_context is not error_context:
+                raise
+            instance = None
+        if instance is None and is_root:
+            raise exceptions.DeserializationError(error_context.all_errors())
+        return instance
 
     @classmethod
     def init(cls):
@@ -106,43 +310,174 @@ class Model(object):
         cls.init()
         return list(cls._field_name_to_field.keys())
 
+    @classmethod
+    def _get_from_json_plan(cls):
+        # The plan is built once per class and cached on the class itself,
+        # so subclasses get their own plan.
+        plan = cls.__dict__.get('_from_json_plan')
+        if plan is None:
+            cls._populate_fields()
+            plan = cls._from_json_plan = _compile_from_json_plan(cls)
+        return plan
+
+    @classmethod
+    def _get_validated_fields(cls):
+        # The (name, field) pairs of fields that have validators of their own
+        validated_fields = cls.__dict__.get('_validated_fields')
+        if validated_fields is None:
+            cls._populate_fields()
+            validated_fields = cls._validated_fields = [
+                (name, field) for name, field in six.iteritems(cls._field_name_to_field)
+                if field.get_validators() or type(field) is not Field]
+        return validated_fields
+
+    @classmethod
+    def _get_active_validators(cls, context):
+        # Maps field name to (field, validators) for the fields with validators
+        # that apply to the service, method and operator of the context
+        key = (context.service, context.method, context.operator)
+        cache = cls.__dict__.get('_active_validators_cache')
+        if cache is None:
+            cache = cls._active_validators_cache = LRUCache(MAX_CACHED_VALIDATOR_CONTEXTS)
+        try:
+            active_validators = cache.get(key)
+        except TypeError:
+            # The operator is read from the raw parent and may not be hashable
+            return cls._compute_active_validators(*key)
+        if active_validators is None:
+            active_validators = cls._compute_active_validators(*key)
+            cache.put(key, active_validators)
+        return active_validators
+
+    @classmethod
+    def _compute_active_validators(cls, service, method, operator):
+        active_validators = {}
+        for name, field in cls._get_validated_fields():
+            validators = [v for v in field.get_validators() if v.applies_to(service, method, operator)]
+            if validators or type(field) is not Field:
+                active_validators[name] = (field, validators)
+        return active_validators
+
+    @classmethod
+    def _requires_context(cls):
+        # Whether deserializing this model with a validation context can
+        # behave any differently than without one, i.e. whether this model
+        # or any model nested below it has validators.
+        requires_context = cls.__dict__.get('_requires_context_flag')
+        if requires_context is None:
+            requires_context = cls._requires_context_flag = _model_requires_context(cls, set())
+        return requires_context
+
+    @classmethod
+    def _get_json_encoder_plan(cls):
+        plan = cls.__dict__.get('_json_encoder_plan')
+        if plan is None:
+            cls._populate_fields()
+            plan = cls._json_encoder_plan = _compile_json_encoder_plan(cls)
+        return plan
+
+    @classmethod
+    def _get_equality_plan(cls):
+        plan = cls.__dict__.get('_equality_plan')
+        if plan is None:
+            cls._populate_fields()
+            plan = cls._equality_plan = _compile_equality_plan(cls)
+        return plan
+
+    @classmethod
+    def _get_to_dict_plan(cls):
+        plan = cls.__dict__.get('_to_dict_plan')
+        if plan is None:
+            cls._populate_fields()
+            plan = cls._to_dict_plan = _compile_to_dict_plan(cls)
+        return plan
+
     @classmethod
     def _populate_fields(cls):
         # Check cls.__dict__ instead of calling hasattr, because we only
         # want to check if the variable exists on the class itself
         # and not any of its parent classes.
+        # Once a class has been populated this is the only check made, so
+        # steady-state instantiation never touches the lock.
+        if '_field_to_attr_name' in cls.__dict__:
+            return
         try:
             # In a multi-threaded environment, different threads can try to build
             # the field name dict at the same time and corrupt it.
             _field_lock.acquire()
             if '_field_to_attr_name' not in cls.__dict__:
-                cls._field_to_attr_name = {}
-                cls._field_name_to_field = {}
+                field_to_attr_name = {}
+                field_name_to_field = {}
                 for attr_name, attr in inspect.getmembers(cls):
                     if attr and isinstance(attr, Field):
-                        cls._field_to_attr_name[attr] = attr_name
-                        cls._field_name_to_field[attr_name] = attr
+                        field_to_attr_name[attr] = attr_name
+                        field_name_to_field[attr_name] = attr
                         attr._name = attr_name
+                # _field_to_attr_name is what the unlocked check above looks for,
+                # so it must only be published once everything else is in place.
+                cls._field_name_to_field = field_name_to_field
+                cls._field_to_attr_name = field_to_attr_name
         finally:
             _field_lock.release()
 
     def __str__(self):
         return self.to_string()
 
+    # Equal to comparing, and consistent with hashing, to_dict(), but without serializing
+    # the field values whose JSON form is the value itself.
     def __eq__(self, other):
-        return type(self) == type(other) and self.to_dict() == other.to_dict()
+        return type(self) == type(other) and self._get_equality_plan()[0](self, other)
 
     def __hash__(self):
-        d = self.to_dict()
-        return hash(_dict_to_tuples(d))
+        if not self.cache_fingerprint:
+            return self._get_equality_plan()[1](self)
+        # The slot is empty until the first call
+        fingerprint = getattr(self, '_fingerprint', None)
+        if fingerprint is None:
+            fingerprint = self._fingerprint = self._get_equality_plan()[1](self)
+        return fingerprint
 
     def to_string(self, indent=''):
-        parts = ['<%s: {' % type(self).__name__]
-        for key in sorted(six.iterkeys(self._data)):
-            formatted_value = self._field_name_to_field[key].to_string(self._data[key], indent)
-            parts.append('  %s%s: %s,' % (indent, key, formatted_value))
-        parts.append('%s}>' % indent)
-        return '\n'.join(parts)
+        return ''.join(_iter_model_string(self, indent))
+
+    def iter_string(self, indent=''):
+        '''Yields the text of to_string() in pieces, so that rendering a large model
+        can be stopped early, e.g. once a log message is long enough.'''
+        return _iter_model_string(self, indent)
+
+class Model(BaseModel):
+    def __getstate__(self):
+        # A cached hash is only valid in the process that computed it
+        state = self.__dict__.copy()
+        state.pop('_fingerprint', None)
+        return state
+
+class _LazyModelDict(Mapping):
+    '''A read-only view of model.to_dict() used as the parent in validation contexts.
+    Each field is serialized the first time it is read, so validators that only look
+    at one or two sibling fields don't pay for serializing the whole model.'''
+
+    def __init__(self, model):
+        self._model = model
+        self._data = model._data
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        data = self._data
+        if key not in data:
+            raise KeyError(key)
+        value = self._values[key] = self._model._field_name_to_field[key].to_json(data[key])
+        return value
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
 
 class Field(object):
     def __init__(self, field_type, validators=(), required=None, readonly=None, description=None, **kwargs):
@@ -161,7 +496,7 @@ class Field(object):
         parsed_value = self._type.from_json(value, error_context, context)
         if error_context.has_errors():
             return None
-        if context:
+        if context and self._validators:
             return self._validate(parsed_value, error_context, context)
         return parsed_value
 
@@ -173,6 +508,8 @@ class Field(object):
 
     def __set__(self, instance, value):
         instance._data[self._name] = self._type.normalize(value)
+        if instance.cache_fingerprint:
+            instance._fingerprint = None
 
     def to_string(self, value, indent):
         return self._type.to_string(value, indent)
@@ -192,8 +529,8 @@ class Field(object):
     def get_description(self):
         return self.description
 
-    def _validate(self, value, error_context, context=None):
-        for validator in self._validators:
+    def _validate(self, value, error_context, context=None, validators=None):
+        for validator in self._validators if validators is None else validators:
             value = validator.validate(value, error_context, context)
             if error_context.has_errors():
                 return None
@@ -207,6 +544,105 @@ class Field(object):
             validators.append(vals.Readonly(readonly))
         return validators
 
+class _CompactField(object):
+    '''Stands in for a Field on a CompactModel class, storing the value in a slot.
+    Accessing the attribute on the class still returns the Field itself.'''
+
+    __slots__ = ('field', 'slot_name', '_get_slot')
+
+    def __init__(self, field, slot_name):
+        self.field = field
+        self.slot_name = slot_name
+        self._get_slot = operator.attrgetter(slot_name)
+
+    def __get__(self, instance, type=None):
+        if instance is None:
+            return self.field
+        try:
+            return self._get_slot(instance)
+        except AttributeError:
+            # An empty slot is an unset field
+            return None
+
+    def __set__(self, instance, value):
+        setattr(instance, self.slot_name, self.field.get_type().normalize(value))
+        if instance.cache_fingerprint:
+            instance._fingerprint = None
+
+def _compact_slot_name(field_name):
+    return '_slot_%s' % field_name
+
+class _CompactModelType(type):
+    def __new__(mcs, name, bases, namespace):
+        fields = {}
+        for base in reversed(bases):
+            for attr_name in dir(base):
+                attr = getattr(base, attr_name, None)
+                if isinstance(attr, Field):
+                    fields[attr_name] = attr
+        for attr_name, attr in six.iteritems(namespace):
+            if isinstance(attr, Field):
+                fields[attr_name] = attr
+
+        new_slots = []
+        for field_name in sorted(fields):
+            slot_name = _compact_slot_name(field_name)
+            if not any(hasattr(base, slot_name) for base in bases):
+                new_slots.append(slot_name)
+        slots = namespace.get('__slots__', ())
+        slots = (slots,) if isinstance(slots, six.string_types) else tuple(slots)
+        namespace = dict(namespace)
+        namespace['__slots__'] = slots + tuple(new_slots)
+
+        cls = super(_CompactModelType, mcs).__new__(mcs, name, bases, namespace)
+        for field_name, field in six.iteritems(fields):
+            setattr(cls, field_name, _CompactField(field, _compact_slot_name(field_name)))
+        cls._compact_slots = dict((field_name, _compact_slot_name(field_name)) for field_name in fields)
+        return cls
+
+@six.add_metaclass(_CompactModelType)
+class CompactModel(BaseModel):
+    '''A model that stores its field values in generated __slots__ instead of a
+    per-instance dict. Subclasses, and all of their base classes, should set
+    __slots__ = () to drop the instance __dict__ as well.
+
+    Compact models are not subclasses of Model, since no subclass of a class
+    with an instance __dict__ can drop it. Check isinstance(x, BaseModel) to
+    accept both kinds, and extend CompactRequest or CompactResponse instead
+    of Request or Response.'''
+
+    __slots__ = ('_fingerprint',)
+
+    def _get_data(self):
+        data = {}
+        for name, slot_name in six.iteritems(self._compact_slots):
+            try:
+                data[name] = getattr(self, slot_name)
+            except AttributeError:
+                pass
+        return data
+
+    def _set_data(self, data):
+        for name, slot_name in six.iteritems(self._compact_slots):
+            if name in data:
+                setattr(self, slot_name, data[name])
+            elif hasattr(self, slot_name):
+                delattr(self, slot_name)
+        if self.cache_fingerprint:
+            self._fingerprint = None
+
+    # Only built on demand, e.g. for to_string() and validation parents
+    _data = property(_get_data, _set_data)
+
+    # Pickle only the field values, since a cached hash is only valid in the
+    # process that computed it
+
+    def __getstate__(self):
+        return self._data
+
+    def __setstate__(self, state):
+        self._data = state
+
 class FieldType(object):
     type_name = None
     json_type = None
@@ -218,6 +654,15 @@ class FieldType(object):
     def from_json(self, value, error_context, context=None):
         return value
 
+    # Field types that can convert many values at once more cheaply than one
+    # at a time override these, and ListType uses them for its items.
+
+    def to_json_many(self, values):
+        return [self.to_json(value) for value in values]
+
+    def from_json_many(self, values, error_context, context=None):
+        return [self.from_json(value, error_context.extend(index=i), context) for i, value in enumerate(values)]
+
     def normalize(self, value):
         return value
 
@@ -341,7 +786,7 @@ class ListType(FieldType):
     json_type = 'list'
 
     def __init__(self, field_type_or_model_class):
-        if inspect.isclass(field_type_or_model_class) and issubclass(field_type_or_model_class, Model):
+        if inspect.isclass(field_type_or_model_class) and issubclass(field_type_or_model_class, BaseModel):
             self._type = ModelType(field_type_or_model_class)
         else:
             self._type = field_type_or_model_class
@@ -349,12 +794,12 @@ class ListType(FieldType):
     def to_json(self, value):
         if value is None:
             return None
-        return [self._type.to_json(item) for item in value]
+        return self._type.to_json_many(value)
 
     def from_json(self, value, error_context, context=None):
         if value is None:
             return None
-        value = [self._type.from_json(item, error_context.extend(index=i), context) for i, item in enumerate(value)]
+        value = self._type.from_json_many(value, error_context, context)
         return value if not error_context.has_errors() else None
 
     def normalize(self, value):
@@ -369,15 +814,86 @@ class ListType(FieldType):
     def to_string(self, value, indent):
         if value is None:
             return six.text_type(None)
-        new_indent = indent + '    '
-        parts = ['['] + ['%s%s,' % (new_indent, self._type.to_string(item, new_indent)) for item in value] + [new_indent + ']']
-        return '\n'.join(parts)
+        return ''.join(_iter_list_string(self._type, value, indent))
+
+def _to_string_items(items, count, indent):
+    # Returns the first TO_STRING_MAX_ITEMS items, and lines noting how many were left out
+    if TO_STRING_MAX_ITEMS is None or count <= TO_STRING_MAX_ITEMS:
+        return items, []
+    return itertools.islice(items, TO_STRING_MAX_ITEMS), ['%s... %d more,' % (indent, count - TO_STRING_MAX_ITEMS)]
+
+# to_string() is rendered piece by piece by these generators, which only call
+# to_string() of the models, fields and field types that override it.
+
+def _iter_model_string(model, indent):
+    if six.get_unbound_function(type(model).to_string) is not six.get_unbound_function(BaseModel.to_string):
+        yield model.to_string(indent)
+        return
+    yield '<%s: {' % type(model).__name__
+    data = model._data
+    fields = model._field_name_to_field
+    for key in sorted(six.iterkeys(data)):
+        yield '\n  %s%s: ' % (indent, key)
+        field = fields[key]
+        if type(field) is Field:
+            for piece in _iter_type_string(field.get_type(), data[key], indent):
+                yield piece
+        else:
+            yield field.to_string(data[key], indent)
+        yield ','
+    yield '\n%s}>' % indent
+
+def _iter_type_string(field_type, value, indent):
+    type_ = type(field_type)
+    if value is None:
+        yield field_type.to_string(value, indent)
+    elif type_ is ModelType:
+        for piece in _iter_model_string(value, indent + '  '):
+            yield piece
+    elif type_ is ListType:
+        for piece in _iter_list_string(field_type.get_item_type(), value, indent):
+            yield piece
+    elif type_ is DictType:
+        for piece in _iter_dict_string(field_type.get_item_type(), value, indent):
+            yield piece
+    else:
+        yield field_type.to_string(value, indent)
+
+def _iter_list_string(item_type, value, indent):
+    if not isinstance(value, (list, tuple)):
+        # E.g. an iterator set by from_json_stream, which must not be consumed here
+        yield STREAMED_LIST_PLACEHOLDER
+        return
+    new_indent = indent + '    '
+    items, more = _to_string_items(value, len(value), new_indent)
+    yield '['
+    for item in items:
+        yield '\n' + new_indent
+        for piece in _iter_type_string(item_type, item, new_indent):
+            yield piece
+        yield ','
+    for line in more:
+        yield '\n' + line
+    yield '\n%s]' % new_indent
+
+def _iter_dict_string(item_type, value, indent):
+    new_indent = indent + '    '
+    items, more = _to_string_items(six.iteritems(value), len(value), new_indent)
+    yield '{'
+    for key, item in items:
+        yield '\n%s%s: ' % (new_indent, key)
+        for piece in _iter_type_string(item_type, item, new_indent):
+            yield piece
+        yield ','
+    for line in more:
+        yield '\n' + line
+    yield '\n%s}' % new_indent
 
 class DictType(FieldType):
     json_type = 'object'
 
     def __init__(self, field_type_or_model_class):
-        if inspect.isclass(field_type_or_model_class) and issubclass(field_type_or_model_class, Model):
+        if inspect.isclass(field_type_or_model_class) and issubclass(field_type_or_model_class, BaseModel):
             self._type = ModelType(field_type_or_model_class)
         else:
             self._type = field_type_or_model_class
@@ -408,16 +924,15 @@ class DictType(FieldType):
     def to_string(self, value, indent):
         if value is None:
             return six.text_type(None)
-        new_indent = indent + '    '
-        parts = ['{'] + ['%s%s: %s,' % (new_indent, k, self._type.to_string(v, new_indent)) for k, v in six.iteritems(value)] + [new_indent + '}']
-        return '\n'.join(parts)
+        return ''.join(_iter_dict_string(self._type, value, indent))
 
 class DateTime(FieldType):
     type_name = 'datetime'
     json_type = 'string'
     description = 'A datetime with time zone in ISO 8601 format (YYYY-MM-DDTHH:MM:SS.mmmmmm+HH:MM)'
 
-    ISO_8601_RE = re.compile('\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,6})?((\+|-)\d{2}:\d{2}|Z)?$')
+    ISO_8601_RE = re.compile(
+        r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(?:(Z)|([+-])(\d{2}):(\d{2}))?$')
 
     def to_json(self, value):
         return six.text_type(value.isoformat()) if value is not None else None
@@ -429,13 +944,18 @@ class DateTime(FieldType):
             error_context.add_error(CommonErrorCodes.INVALID_TYPE,
                 'Value %s is invalid for datetime. Value must be a string in ISO 8601 format (YYYY-MM-DDTHH:MM:SS.mmmmmm+HH:MM)' % value)
             return None
-        if self.ISO_8601_RE.match(value):
+        match = self.ISO_8601_RE.match(value)
+        dt = None
+        if match:
             try:
-                dt = dateutil_parser.parse(six.text_type(value))
+                dt = _parse_iso_8601(match)
             except ValueError:
-                dt = None
-        else:
-            dt = None
+                # Out of range values, left to dateutil if it's installed
+                if dateutil_parser:
+                    try:
+                        dt = dateutil_parser.parse(six.text_type(value))
+                    except ValueError:
+                        pass
         if not dt:
             error_context.add_error(
                 CommonErrorCodes.INVALID_VALUE,
@@ -443,11 +963,46 @@ class DateTime(FieldType):
             return None
         return dt
 
+if dateutil_tz:
+    _UTC = dateutil_tz.tzutc()
+    _make_tzoffset = lambda seconds: dateutil_tz.tzoffset(None, seconds)
+else:
+    _UTC = datetime.timezone.utc
+    _make_tzoffset = lambda seconds: datetime.timezone(datetime.timedelta(seconds=seconds))
+
+# UTC offset in seconds -> tzinfo, shared by all parsed datetimes
+_tzoffsets = {0: _UTC}
+
+def _get_tzoffset(seconds):
+    tzinfo = _tzoffsets.get(seconds)
+    if tzinfo is None:
+        tzinfo = _tzoffsets[seconds] = _make_tzoffset(seconds)
+    return tzinfo
+
+def _parse_iso_8601(match):
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes = match.groups()
+    if utc:
+        tzinfo = _UTC
+    elif sign:
+        offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+        tzinfo = _get_tzoffset(-offset if sign == '-' else offset)
+    else:
+        tzinfo = None
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour), int(minute), int(second),
+        int(fraction.ljust(6, '0')) if fraction else 0, tzinfo)
+
 class Date(FieldType):
     type_name = 'date'
     json_type = 'string'
     description = 'A date in ISO 8601 format (YYYY-MM-DD)'
 
+    # Accepts exactly what datetime.strptime(value, '%Y-%m-%d') does
+    DATE_RE = re.compile(r'(\d\d\d\d)-(1[0-2]|0[1-9]|[1-9])-(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\Z')
+
+    # Parsed dates by string, shared by all Date fields. Set cache.maxsize to resize it.
+    cache = LRUCache(1024)
+
     def to_json(self, value):
         return six.text_type(value.isoformat()) if value is not None else None
 
@@ -458,10 +1013,18 @@ class Date(FieldType):
             error_context.add_error(CommonErrorCodes.INVALID_TYPE,
                 'Value %s is invalid for date. Value must be a string in ISO 8601 format (YYYY-MM-DD)' % value)
             return None
-        try:
-            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
-        except ValueError:
-            pass
+        date = self.cache.get(value)
+        if date is not None:
+            return date
+        match = self.DATE_RE.match(value)
+        if match:
+            try:
+                date = datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+            except ValueError:
+                pass
+            else:
+                self.cache.put(value, date)
+                return date
         error_context.add_error(
             CommonErrorCodes.INVALID_VALUE,
            'Unable to parse "%s" as a date. Value must be a string in ISO 8601 format (YYYY-MM-DD)' % value)
@@ -544,19 +1107,18 @@ class EnumValues(object):
             cls._values = sorted(values)
         return cls._values
 
+_ID_STRING_TYPES = frozenset((str, six.text_type))
+
 class EncryptedId(FieldType):
     type_name = 'id'
     json_type = 'string'
     description = 'An entity id'
 
     def __init__(self):
-        if not hashids:
-            raise exceptions.ModuleRequired('You must install the hashids module in order to use EncryptedId fields')
-        if not ID_HASHER:
-            _create_id_hasher()
+        get_id_codec()
 
     def to_json(self, value):
-        return ID_HASHER.encode(value) if value is not None else None
+        return get_id_codec().encode(value) if value is not None else None
 
     def from_json(self, value, error_context, context=None):
         if value is None:
@@ -564,13 +1126,28 @@ class EncryptedId(FieldType):
         if type(value) not in (str, six.text_type):
             error_context.add_error(CommonErrorCodes.INVALID_TYPE, 'Ids must be passed as strings')
             return None
-        # Unclear why this doesn't work with unicode values,
-        # must coerce it to be a string.
-        ids = ID_HASHER.decode(str(value))
-        if not ids or len(ids) > 1:
+        decoded = get_id_codec().decode(value)
+        if decoded is None:
             error_context.add_error(CommonErrorCodes.INVALID_VALUE, '"%s" is not a valid id' % value)
-            return None
-        return ids[0]
+        return decoded
+
+    def to_json_many(self, values):
+        if not isinstance(values, list):
+            values = list(values)
+        if None in values:
+            return super(EncryptedId, self).to_json_many(values)
+        return get_id_codec().encode_many(values)
+
+    def from_json_many(self, values, error_context, context=None):
+        if type(values) is not list or not _ID_STRING_TYPES.issuperset(map(type, values)):
+            return super(EncryptedId, self).from_json_many(values, error_context, context)
+        decoded = get_id_codec().decode_many(values)
+        if None in decoded:
+            for i, value in enumerate(values):
+                if decoded[i] is None:
+                    error_context.extend(index=i).add_error(
+                        CommonErrorCodes.INVALID_VALUE, '"%s" is not a valid id' % value)
+        return decoded
 
 class AnyPrimitive(FieldType):
     type_name = 'any'
@@ -592,3 +1169,710 @@ def _dict_to_tuples(value):
     elif isinstance(value, list):
         return tuple(_dict_to_tuples(v) for v in value)
     return value
+
+# Deserialization plans
+#
+# Model.from_json is driven by a plan compiled once per model class. The plan
+# parses each field with the bound from_json of its built-in field type,
+# skips the call entirely for raw values that are already in their parsed
+# form, and assembles the instance's data directly instead of going back
+# through __init__ and Field.__set__. Custom Field and FieldType subclasses
+# go through the generic Field.from_json/Field.__set__ path.
+
+# Raw JSON value types that a built-in field type's from_json returns unchanged.
+_JSON_VALUE_TYPES = (dict, list, six.text_type, str, float, bool) + six.integer_types
+
+_FROM_JSON_PASSTHROUGH_TYPES = {
+    String: (six.text_type,),
+    Integer: six.integer_types,
+    Float: (float,),
+    Boolean: (bool,),
+    AnyPrimitive: _JSON_VALUE_TYPES,
+}
+
+# Field types whose from_json already returns normalized values.
+_FROM_JSON_NORMALIZED_TYPES = (
+    String, Bytes, Integer, Float, Boolean, ModelType, ListType, DictType,
+    DateTime, Date, Decimal, Enum, EncryptedId, AnyPrimitive)
+
+def _compile_field_parser(field_type):
+    passthrough = _FROM_JSON_PASSTHROUGH_TYPES.get(type(field_type), ())
+    parse = field_type.from_json
+    if type(field_type) in (ListType, DictType):
+        item_passthrough = _FROM_JSON_PASSTHROUGH_TYPES.get(type(field_type.get_item_type()))
+        if item_passthrough:
+            if type(field_type) is ListType:
+                def parse(value, error_context, context=None):
+                    if type(value) is list and all(item is None or type(item) in item_passthrough for item in value):
+                        return list(value)
+                    return field_type.from_json(value, error_context, context)
+            else:
+                def parse(value, error_context, context=None):
+                    if type(value) is dict and all(item is None or type(item) in item_passthrough for item in six.itervalues(value)):
+                        return dict(value)
+                    return field_type.from_json(value, error_context, context)
+    return parse, passthrough
+
+# Built-in field types that never look at the validation context themselves
+_CONTEXT_FREE_TYPES = (
+    String, Bytes, Integer, Float, Boolean, DateTime, Date, Decimal, Enum, EncryptedId, AnyPrimitive)
+
+def _overrides(model_class, method_name):
+    return getattr(model_class, method_name).__func__ is not getattr(BaseModel, method_name).__func__
+
+def _field_type_requires_context(field_type, seen):
+    type_ = type(field_type)
+    if type_ in _CONTEXT_FREE_TYPES:
+        return False
+    if type_ is ModelType:
+        return _model_requires_context(field_type.get_model_class(), seen)
+    if type_ in (ListType, DictType):
+        return _field_type_requires_context(field_type.get_item_type(), seen)
+    # Custom field types may use the context in from_json
+    return True
+
+def _model_requires_context(model_class, seen):
+    if model_class in seen:
+        return False
+    seen.add(model_class)
+    if _overrides(model_class, 'from_json'):
+        return True
+    if model_class._get_validated_fields():
+        return True
+    for field in model_class.get_fields():
+        if _field_type_requires_context(field.get_type(), seen):
+            return True
+    return False
+
+def _compile_from_json_plan(model_class):
+    # One step per field, in field order, so that errors are reported in the
+    # same order as Field.from_json would report them
+    steps = []
+    for name, field in six.iteritems(model_class._field_name_to_field):
+        if type(field) is Field and type(field.get_type()) in _FROM_JSON_NORMALIZED_TYPES:
+            parse, passthrough = _compile_field_parser(field.get_type())
+            # Subtrees without any validators are parsed without a context,
+            # which lets nested models skip make_parent_context and validation.
+            requires_context = _field_type_requires_context(field.get_type(), set())
+            steps.append((name, field, parse, passthrough, requires_context, None))
+        else:
+            steps.append((name, field, None, None, None, field.get_type().normalize))
+    field_names = frozenset(model_class._field_name_to_field)
+    # Fields that are plain Fields store their normalized value, so the instance
+    # can be built without going through __init__ and __set__
+    construct_directly = (six.get_unbound_function(model_class.__init__) is six.get_unbound_function(BaseModel.__init__)
+        and all(type(field) is Field for field in six.itervalues(model_class._field_name_to_field)))
+
+    def from_json(obj, error_context, context):
+        data = {}
+        active_validators = model_class._get_active_validators(context) if context else {}
+        for name, field, parse, passthrough, requires_context, normalize in steps:
+            value = obj.get(name)
+            if parse is None:
+                value = field.from_json(value, error_context.extend(field=name), context)
+                data[name] = normalize(value) if construct_directly else value
+                continue
+            field_error_context = None
+            if value is not None and type(value) not in passthrough:
+                field_error_context = error_context.extend(field=name)
+                value = parse(value, field_error_context, context if requires_context else None)
+                if field_error_context.has_errors():
+                    data[name] = None
+                    continue
+            if name in active_validators:
+                value = field._validate(
+                    value, field_error_context or error_context.extend(field=name), context, active_validators[name][1])
+            data[name] = value
+        if not field_names.issuperset(obj):
+            for key in obj:
+                if key not in field_names:
+                    error_context.extend(field=key).add_error(CommonErrorCodes.UNKNOWN_FIELD, 'Unknown field "%s"' % key)
+        if error_context.has_errors():
+            return None
+        if not construct_directly:
+            return model_class(**data)
+        instance = model_class.__new__(model_class)
+        instance._data = data
+        return instance
+
+    return from_json
+
+# Serialization plans
+#
+# Model.to_dict is likewise driven by a plan compiled once per model class.
+# Each field gets a (passthrough_types, serialize) pair: values whose type
+# is in passthrough_types are already in their JSON form and are copied as
+# is, anything else goes through serialize. Lists, dicts and nested models
+# are compiled recursively, so serializing a tree of models never goes
+# through Field.to_json/FieldType.to_json for built-in types.
+
+_NoneType = type(None)
+
+_TO_JSON_PASSTHROUGH_TYPES = {
+    String: (_NoneType, six.text_type),
+    Bytes: (_NoneType, bytes),
+    Integer: (_NoneType,) + six.integer_types,
+    Float: (_NoneType, float),
+    Boolean: (_NoneType, bool),
+    Enum: (_NoneType, six.text_type),
+    Decimal: (_NoneType,),
+    DateTime: (_NoneType,),
+    Date: (_NoneType,),
+    EncryptedId: (_NoneType,),
+}
+
+def _batches_to_json(field_type):
+    return six.get_unbound_function(type(field_type).to_json_many) is not six.get_unbound_function(FieldType.to_json_many)
+
+def _uses_default_to_dict(model_class):
+    return (six.get_unbound_function(model_class.to_json) is six.get_unbound_function(BaseModel.to_json)
+        and six.get_unbound_function(model_class.to_dict) is six.get_unbound_function(BaseModel.to_dict))
+
+def _compile_model_serializer(model_class):
+    # The nested model's own plan is looked up lazily, since models may
+    # refer to themselves.
+    direct = _uses_default_to_dict(model_class)
+    def serialize(value):
+        if direct and type(value) is model_class:
+            return model_class._get_to_dict_plan()(value)
+        return value.to_json()
+    return serialize
+
+def _compile_field_serializer(field_type):
+    '''Returns a (passthrough_types, serialize) pair for the given field type.
+    A serialize of None means every value is passed through unchanged.'''
+    type_ = type(field_type)
+    if type_ is AnyPrimitive:
+        return (), None
+    if type_ in _TO_JSON_PASSTHROUGH_TYPES:
+        return _TO_JSON_PASSTHROUGH_TYPES[type_], field_type.to_json
+    if type_ is ModelType:
+        return (_NoneType,), _compile_model_serializer(field_type.get_model_class())
+    if type_ in (ListType, DictType):
+        item_passthrough, item_serialize = _compile_field_serializer(field_type.get_item_type())
+        if type_ is ListType:
+            if _batches_to_json(field_type.get_item_type()):
+                return (_NoneType,), field_type.get_item_type().to_json_many
+            if item_serialize is None:
+                return (_NoneType,), list
+            def serialize(value):
+                return [item if type(item) in item_passthrough else item_serialize(item) for item in value]
+        else:
+            if item_serialize is None:
+                return (_NoneType,), dict
+            def serialize(value):
+                return {k: v if type(v) in item_passthrough else item_serialize(v) for k, v in six.iteritems(value)}
+        return (_NoneType,), serialize
+    return (), field_type.to_json
+
+def _compile_to_dict_plan(model_class):
+    serializers = {}
+    for name, field in six.iteritems(model_class._field_name_to_field):
+        if type(field) is Field:
+            serializers[name] = _compile_field_serializer(field.get_type())
+        else:
+            serializers[name] = ((), field.to_json)
+
+    def to_dict(instance):
+        result = {}
+        for key, value in six.iteritems(instance._data):
+            passthrough, serialize = serializers[key]
+            if serialize is None or type(value) in passthrough:
+                result[key] = value
+            else:
+                result[key] = serialize(value)
+        return result
+
+    compact_slots = model_class.__dict__.get('_compact_slots')
+    if compact_slots is None:
+        return to_dict
+
+    # Compact models are read straight from their slots, skipping _data
+    compact_serializers = [
+        (name, operator.attrgetter(slot_name)) + serializers[name] for name, slot_name in six.iteritems(compact_slots)]
+
+    def compact_to_dict(instance):
+        result = {}
+        for key, get, passthrough, serialize in compact_serializers:
+            try:
+                value = get(instance)
+            except AttributeError:
+                continue
+            if serialize is None or type(value) in passthrough:
+                result[key] = value
+            else:
+                result[key] = serialize(value)
+        return result
+
+    return compact_to_dict
+
+# Equality and hashing plans
+#
+# Model.__eq__ and Model.__hash__ behave as if they compared and hashed
+# to_dict(), but are driven by a plan compiled once per model class that
+# compares and hashes field values directly where their JSON form is the
+# value itself, or a one-to-one encoding of it like an EncryptedId's.
+# Only other values are serialized, one field value at a time. Each field
+# gets an (equal, hash_key) pair of functions, where equal(a, b) is
+# hash_key(a) == hash_key(b), computed without building the keys.
+
+_DIRECT_COMPARISON_TYPES = dict(_TO_JSON_PASSTHROUGH_TYPES)
+_DIRECT_COMPARISON_TYPES[EncryptedId] = (_NoneType,) + six.integer_types
+
+def _models_equal(a, b):
+    if a is None or b is None:
+        return a is b
+    if type(a) is type(b):
+        return type(a)._get_equality_plan()[0](a, b)
+    return a.to_json() == b.to_json()
+
+def _model_hash_key(value):
+    return BaseModel.__hash__(value) if value is not None else None
+
+def _compile_field_comparison(field_type, serialize=None):
+    '''Returns an (equal, hash_key) pair for the given field type, or for values
+    serialized with the given function.'''
+    type_ = type(field_type)
+    if serialize is not None:
+        direct = ()
+    elif type_ is ModelType:
+        return _models_equal, _model_hash_key
+    elif type_ in (ListType, DictType):
+        item_equal, item_key = _compile_field_comparison(field_type.get_item_type())
+        if type_ is ListType:
+            def equal(a, b):
+                if a is None or b is None:
+                    return a is b
+                return len(a) == len(b) and all(x is y or item_equal(x, y) for x, y in six.moves.zip(a, b))
+            def hash_key(value):
+                return tuple([item_key(item) for item in value]) if value is not None else None
+        else:
+            def equal(a, b):
+                if a is None or b is None:
+                    return a is b
+                if len(a) != len(b):
+                    return False
+                for k, v in six.iteritems(a):
+                    if k not in b:
+                        return False
+                    other = b[k]
+                    if v is not other and not item_equal(v, other):
+                        return False
+                return True
+            def hash_key(value):
+                return frozenset([(k, item_key(v)) for k, v in six.iteritems(value)]) if value is not None else None
+        return equal, hash_key
+    elif type_ is AnyPrimitive:
+        direct, serialize = _JSON_VALUE_TYPES + (_NoneType,), None
+    else:
+        direct = _DIRECT_COMPARISON_TYPES.get(type_, ())
+        serialize = field_type.to_json
+
+    if serialize is None:
+        # Lists and dicts of arbitrary values still need converting for hashing
+        def hash_key(value):
+            return _dict_to_tuples(value)
+        def equal(a, b):
+            return a == b
+        return equal, hash_key
+
+    def equal(a, b):
+        if type(a) not in direct:
+            a = serialize(a)
+        if type(b) not in direct:
+            b = serialize(b)
+        return a == b
+    def hash_key(value):
+        return value if type(value) in direct else _dict_to_tuples(serialize(value))
+    return equal, hash_key
+
+def _compile_equality_plan(model_class):
+    '''Returns an (equal, fingerprint) pair of functions for instances of model_class'''
+    if not _uses_default_to_dict(model_class):
+        def equal(a, b):
+            return a.to_dict() == b.to_dict()
+        def fingerprint(instance):
+            return hash(_dict_to_tuples(instance.to_dict()))
+        return equal, fingerprint
+
+    comparisons = {}
+    for name, field in six.iteritems(model_class._field_name_to_field):
+        if type(field) is Field:
+            comparisons[name] = _compile_field_comparison(field.get_type())
+        else:
+            comparisons[name] = _compile_field_comparison(None, field.to_json)
+
+    def equal(a, b):
+        a_data = a._data
+        b_data = b._data
+        if len(a_data) != len(b_data):
+            return False
+        for name, value in six.iteritems(a_data):
+            if name not in b_data:
+                return False
+            other = b_data[name]
+            if value is not other and not comparisons[name][0](value, other):
+                return False
+        return True
+
+    def fingerprint(instance):
+        return hash(frozenset([(name, comparisons[name][1](value)) for name, value in six.iteritems(instance._data)]))
+
+    return equal, fingerprint
+
+# JSON encoding plans
+#
+# Model.to_json_bytes encodes a model straight to JSON text, without building
+# the dict tree that to_dict returns. Each built-in field type compiles to an
+# encoder that turns a value into its JSON text, producing exactly what
+# json.dumps(to_json()) would. Values of unexpected types, and custom field
+# types, fall back to to_json and the stdlib encoder.
+
+try:
+    from json.encoder import c_encode_basestring_ascii as _encode_string
+except ImportError:
+    _encode_string = None
+if _encode_string is None:
+    from json.encoder import encode_basestring_ascii as _encode_string
+
+_float_repr = float.__repr__
+_INFINITY = float('inf')
+
+def _encode_float(value):
+    if value != value:
+        return 'NaN'
+    if value == _INFINITY:
+        return 'Infinity'
+    if value == -_INFINITY:
+        return '-Infinity'
+    return _float_repr(value)
+
+def _encode_bool(value):
+    return 'true' if value else 'false'
+
+def _compile_field_encoder(field_type):
+    '''Returns a function encoding values of the given field type, including None, as JSON text'''
+    type_ = type(field_type)
+    fallback = lambda value: _json_encoder.encode(field_type.to_json(value))
+    if type_ in (String, Enum):
+        encoders = {six.text_type: _encode_string}
+    elif type_ is Integer:
+        encoders = dict((integer_type, str) for integer_type in six.integer_types)
+    elif type_ is Float:
+        encoders = {float: _encode_float}
+    elif type_ is Boolean:
+        encoders = {bool: _encode_bool}
+    elif type_ in (DateTime, Date, Decimal, EncryptedId):
+        to_json = field_type.to_json
+        encode = lambda value: _encode_string(to_json(value))
+        encoders = {datetime.datetime: encode, datetime.date: encode, decimal.Decimal: encode}
+        if type_ is EncryptedId:
+            encoders = dict((integer_type, encode) for integer_type in six.integer_types)
+    elif type_ is AnyPrimitive:
+        return lambda value: _json_encoder.encode(value)
+    elif type_ is ModelType:
+        encode_model = _compile_model_encoder(field_type.get_model_class())
+        encoders = {}
+        fallback = lambda value: encode_model(value)
+    elif type_ is ListType and _batches_to_json(field_type.get_item_type()):
+        to_json_many = field_type.get_item_type().to_json_many
+        encoders = {list: lambda value: _json_encoder.encode(to_json_many(value))}
+    elif type_ is ListType:
+        encode_item = _compile_field_encoder(field_type.get_item_type())
+        encoders = {list: lambda value: '[' + ', '.join([encode_item(item) for item in value]) + ']'}
+    elif type_ is DictType:
+        encode_item = _compile_field_encoder(field_type.get_item_type())
+        def encode_dict(value):
+            parts = []
+            for k, v in six.iteritems(value):
+                if type(k) is not six.text_type:
+                    # Let the stdlib encoder convert other key types
+                    return fallback(value)
+                parts.append(_encode_string(k) + ': ' + encode_item(v))
+            return '{' + ', '.join(parts) + '}'
+        encoders = {dict: encode_dict}
+    else:
+        return fallback
+    get_encoder = encoders.get
+
+    def encode(value):
+        if value is None:
+            return 'null'
+        return get_encoder(type(value), fallback)(value)
+    return encode
+
+def _compile_model_encoder(model_class):
+    direct = _uses_default_to_dict(model_class)
+    def encode(value):
+        if direct and type(value) is model_class:
+            return model_class._get_json_encoder_plan()(value)
+        return _json_encoder.encode(value.to_json())
+    return encode
+
+def _get_field_encoders(model_class):
+    # Maps each field name to its encoded key and value encoder
+    encoders = model_class.__dict__.get('_json_field_encoders')
+    if encoders is None:
+        encoders = {}
+        for name, field in six.iteritems(model_class._field_name_to_field):
+            if type(field) is Field:
+                encode = _compile_field_encoder(field.get_type())
+            else:
+                encode = lambda value, field=field: _json_encoder.encode(field.to_json(value))
+            encoders[name] = (_json_encoder.encode(name) + ': ', encode)
+        model_class._json_field_encoders = encoders
+    return encoders
+
+def _compile_json_encoder_plan(model_class):
+    encoders = _get_field_encoders(model_class)
+
+    def encode(instance):
+        parts = []
+        for key, value in six.iteritems(instance._data):
+            encoded_key, encode_value = encoders[key]
+            parts.append(encoded_key + encode_value(value))
+        return '{' + ', '.join(parts) + '}'
+
+    compact_slots = model_class.__dict__.get('_compact_slots')
+    if compact_slots is None:
+        return encode
+
+    compact_encoders = [
+        (operator.attrgetter(slot_name),) + encoders[name] for name, slot_name in six.iteritems(compact_slots)]
+
+    def compact_encode(instance):
+        parts = []
+        for get, key, encode_value in compact_encoders:
+            try:
+                value = get(instance)
+            except AttributeError:
+                continue
+            parts.append(key + encode_value(value))
+        return '{' + ', '.join(parts) + '}'
+
+    return compact_encode
+
+# Streaming serialization
+#
+# Model.iter_json walks the model tree and encodes it piece by piece, so
+# only one model's scalar fields (or one batch of a scalar list) is in its
+# JSON form at a time. The output is identical to json.dumps(to_json()).
+
+_json_encoder = json.JSONEncoder(default=jsonbackend.json_default)
+
+# Scalar lists are encoded this many items at a time
+_JSON_STREAM_LIST_BATCH = 1000
+
+def _iter_json_chunks(pieces, chunk_size):
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def _iter_model_json(model):
+    if not _uses_default_to_dict(type(model)):
+        yield _json_encoder.encode(model.to_json())
+        return
+    data = model._data
+    if not data:
+        yield '{}'
+        return
+    fields = model._field_name_to_field
+    encoders = _get_field_encoders(type(model))
+    separator = '{'
+    for key, value in six.iteritems(data):
+        encoded_key, encode_value = encoders[key]
+        field = fields[key]
+        if value is not None and type(field) is Field and _is_streamed_type(field.get_type()):
+            yield separator + encoded_key
+            for piece in _iter_field_json(field.get_type(), value):
+                yield piece
+        else:
+            # Scalars are encoded with the same encoders as to_json_bytes()
+            yield separator + encoded_key + encode_value(value)
+        separator = ', '
+    yield '}'
+
+def _encode_json_key(key):
+    # Converts keys the way json.dumps does
+    if isinstance(key, six.string_types):
+        return _json_encoder.encode(key)
+    if key is None or isinstance(key, (bool, float) + six.integer_types):
+        return '"%s"' % _json_encoder.encode(key)
+    raise TypeError('Keys must be str, int, float, bool or None, not %s' % type(key).__name__)
+
+def _is_streamed_type(field_type):
+    return type(field_type) in (ModelType, ListType, DictType)
+
+def _iter_field_json(field_type, value):
+    type_ = type(field_type)
+    if value is None:
+        yield 'null'
+    elif type_ is ModelType:
+        for piece in _iter_model_json(value):
+            yield piece
+    elif type_ is ListType and not isinstance(value, (list, tuple)):
+        yield _json_encoder.encode(STREAMED_LIST_PLACEHOLDER)
+    elif type_ is ListType and _is_streamed_type(field_type.get_item_type()):
+        item_type = field_type.get_item_type()
+        separator = '['
+        for item in value:
+            yield separator
+            separator = ', '
+            for piece in _iter_field_json(item_type, item):
+                yield piece
+        yield '[]' if separator == '[' else ']'
+    elif type_ is ListType:
+        to_json_many = field_type.get_item_type().to_json_many
+        if not value:
+            yield '[]'
+            return
+        separator = '['
+        for start in six.moves.range(0, len(value), _JSON_STREAM_LIST_BATCH):
+            batch = to_json_many(value[start:start + _JSON_STREAM_LIST_BATCH])
+            yield separator + _json_encoder.encode(batch)[1:-1]
+            separator = ', '
+        yield ']'
+    elif type_ is DictType and _is_streamed_type(field_type.get_item_type()):
+        item_type = field_type.get_item_type()
+        separator = '{'
+        for key, item in six.iteritems(value):
+            yield separator + _encode_json_key(key) + ': '
+            separator = ', '
+            for piece in _iter_field_json(item_type, item):
+                yield piece
+        yield '{}' if separator == '{' else '}'
+    else:
+        yield _json_encoder.encode(field_type.to_json(value))
+
+# Stream deserialization
+
+class _StreamedParentDict(Mapping):
+    '''The parent in validation contexts for a model read by from_json_stream: the raw
+    values read from the stream, and the lists that were parsed item by item, which
+    are converted back to their JSON form the first time they are read.'''
+
+    def __init__(self, raw_values, parsed_values, fields):
+        self.raw_values = dict(raw_values)
+        self._parsed_values = parsed_values
+        self._fields = fields
+
+    def __getitem__(self, key):
+        raw_values = self.raw_values
+        if key not in raw_values:
+            raw_values[key] = self._fields[key].to_json(self._parsed_values[key])
+        return raw_values[key]
+
+    def __iter__(self):
+        return itertools.chain(self.raw_values, (key for key in self._parsed_values if key not in self.raw_values))
+
+    def __len__(self):
+        return len(set(self.raw_values).union(self._parsed_values))
+
+def _set_field_value(instance, name, value):
+    # Sets a value without normalizing it, e.g. to keep an iterator lazy
+    compact_slots = getattr(type(instance), '_compact_slots', None)
+    if compact_slots is not None:
+        setattr(instance, compact_slots[name], value)
+    else:
+        instance._data[name] = value
+
+def _from_json_stream(model_class, reader, error_context, context, iter_field):
+    fields = model_class._field_name_to_field
+    if iter_field is not None:
+        if iter_field not in fields:
+            raise exceptions.UnknownFieldException('Unknown field "%s"' % iter_field)
+        if type(fields[iter_field].get_type()) is not ListType:
+            raise exceptions.ApilibException('Field "%s" is not a list and cannot be iterated' % iter_field)
+
+    obj = {}
+    parsed = {}
+    lazy_items = None
+    for key in reader.iter_object():
+        field = fields.get(key)
+        field_type = field.get_type() if field is not None else None
+        if (type(field_type) is ListType
+                and (key == iter_field or type(field_type.get_item_type()) is ModelType)
+                and reader.peek() == '['):
+            item_type = field_type.get_item_type()
+            # Only the keys read so far are visible to the items as their parent
+            item_context = None
+            if context and _field_type_requires_context(item_type, set()):
+                item_context = model_class.make_parent_context(obj, context)
+            field_error_context = error_context.extend(field=key)
+            if key == iter_field:
+                raw_items = reader.iter_array()
+                # The first item is read now, so that validators of the other
+                # fields can tell whether the list is empty
+                try:
+                    first_items = list(itertools.islice(raw_items, 1))
+                except jsonstream.JsonStreamError as e:
+                    field_error_context.add_error(CommonErrorCodes.INVALID_VALUE, 'Invalid JSON: %s' % e)
+                    parsed[key] = None
+                    break
+                lazy_items = _iter_stream_items(
+                    reader, itertools.chain(first_items, raw_items), item_type, field_error_context, item_context)
+                break
+            items = [item_type.from_json(item, field_error_context.extend(index=i), item_context)
+                for i, item in enumerate(reader.iter_array())]
+            parsed[key] = items if not field_error_context.has_errors() else None
+        else:
+            obj[key] = reader.read_value()
+    else:
+        reader.end()
+
+    if context:
+        parent = _StreamedParentDict(obj, parsed, fields)
+        if lazy_items is not None:
+            # Only the first item has been read
+            parent.raw_values[iter_field] = first_items
+        context = model_class.make_parent_context(parent, context)
+    active_validators = model_class._get_active_validators(context) if context else {}
+    data = {}
+    for name, field in six.iteritems(fields):
+        if lazy_items is not None and name == iter_field:
+            continue
+        field_error_context = error_context.extend(field=name)
+        if name in parsed:
+            value = parsed[name]
+            if value is not None and name in active_validators:
+                value = field._validate(value, field_error_context, context, active_validators[name][1])
+        else:
+            value = field.from_json(obj.get(name), field_error_context, context)
+        data[name] = value
+    for key in obj:
+        if key not in fields:
+            error_context.extend(field=key).add_error(CommonErrorCodes.UNKNOWN_FIELD, 'Unknown field "%s"' % key)
+    if error_context.has_errors():
+        return None
+    instance = model_class(**data)
+    if lazy_items is not None:
+        _set_field_value(instance, iter_field, lazy_items)
+    return instance
+
+def _iter_stream_items(reader, raw_items, item_type, error_context, context):
+    try:
+        for i, item in enumerate(raw_items):
+            item_error_context = error_context.extend(index=i)
+            value = item_type.from_json(item, item_error_context, context)
+            if item_error_context.has_errors():
+                raise exceptions.StreamDeserializationError(item_error_context.all_errors())
+            yield value
+        try:
+            reader.end_object()
+        except jsonstream.JsonStreamError:
+            error_context.add_error(CommonErrorCodes.INVALID_VALUE, 'Must be the last field of the object')
+            raise exceptions.StreamDeserializationError(error_context.all_errors())
+        reader.end()
+    except jsonstream.JsonStreamError as e:
+        error_context.add_error(CommonErrorCodes.INVALID_VALUE, 'Invalid JSON: %s' % e)
+        raise exceptions.StreamDeserializationError(error_context.all_errors())
+    except exceptions.ErrorLimitReached as e:
+        raise exceptions.StreamDeserializationError(e.error_context.all_errors())
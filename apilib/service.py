@@ -2,16 +2,60 @@ from __future__ import absolute_import
 
 import inspect
 import logging
+import threading
 import traceback
 
 import requests
+import six
+from six.moves import http_cookiejar
 
 from . import exceptions
+from . import jsonbackend
+from . import jsonstream
 from . import model
 from . import validation
 
 logger = logging.getLogger(__name__)
 
+class _LazyLogValue(object):
+    '''A log message argument that is only formatted if the message is emitted'''
+
+    __slots__ = ('_format', '_args')
+
+    def __init__(self, format, *args):
+        self._format = format
+        self._args = args
+
+    def __str__(self):
+        return self._format(*self._args)
+
+    __unicode__ = __str__
+
+def _truncate(chunks, max_length):
+    # Joins text chunks, stopping once there are more than max_length characters
+    parts = []
+    length = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if max_length is not None and length > max_length:
+            return u'%s... (truncated)' % u''.join(parts)[:max_length]
+    return u''.join(parts)
+
+def _format_model(value, max_length):
+    # Renders to_string() piece by piece, so a large model isn't rendered past max_length
+    if value is None or six.get_unbound_function(type(value).__str__) is not six.get_unbound_function(model.BaseModel.__str__):
+        return _truncate([six.text_type(value)], max_length)
+    return _truncate(value.iter_string(), max_length)
+
+def _format_model_json(model, max_length):
+    if not model:
+        return six.text_type(None)
+    return _truncate(model.iter_json(max_length), max_length)
+
+def _format_exc():
+    return traceback.format_exc() or ''
+
 class ApiError(model.Model):
     code = model.Field(model.String())
     path = model.Field(model.String())
@@ -28,6 +72,17 @@ class Response(model.Model):
     response_code = model.Field(model.String())
     errors = model.Field(model.ListType(ApiError))
 
+class CompactRequest(model.CompactModel):
+    __slots__ = ()
+
+# The compact counterpart of Response, for responses that are held in memory
+# in large numbers. Subclasses should set __slots__ = ().
+class CompactResponse(model.CompactModel):
+    __slots__ = ()
+
+    response_code = model.Field(model.String())
+    errors = model.Field(model.ListType(ApiError))
+
 class ResponseCode(object):
     SUCCESS = 'SUCCESS'
     SERVER_ERROR = 'SERVER_ERROR'
@@ -78,6 +133,9 @@ class Service(object):
     path = None
     name = None
     public = None
+    # The name of the JSON backend used to encode and decode request and response
+    # bodies, e.g. 'orjson' or 'auto'. Defaults to the process-wide backend.
+    json_backend = None
 
     def get_name(self):
         if self.name:
@@ -101,54 +159,107 @@ class ServiceImplementation(Service):
             return FooResponse(...)
     '''
 
+    # Set to stop parsing and validating a request once this many errors have
+    # been found, and respond with a REQUEST_ERROR listing just those errors.
+    max_request_errors = None
+    # Requests and responses are cut off after this many characters in log messages,
+    # None to log them in full.
+    max_log_length = 10000
+
     def invoke(self, method_name, request, already_validated=False):
         self.log_request(method_name, request)
 
         method_descriptor = self.resolve_method(method_name)
         method = getattr(self, method_descriptor.name)
 
-        if already_validated:
-            validation_errors = None
-        else:
-            error_context = validation.ErrorContext()
-            validation_context = validation.ValidationContext(service=self.get_name(), method=method_name)
-            request.validate(error_context, validation_context)
-            validation_errors = error_context.all_errors()
-
+        validation_errors = None if already_validated else self._validate_request(method_name, request)
         if validation_errors:
-            response = method_descriptor.response_class(
-                response_code=ResponseCode.REQUEST_ERROR,
-                errors=[ApiError(code=ve.code, path=ve.path, message=ve.msg) for ve in validation_errors])
+            response = self._request_error_response(method_descriptor, validation_errors)
         else:
             try:
                 response = method(request)
                 response.response_code = ResponseCode.SUCCESS
-            except ApiException as e:
-                response = method_descriptor.response_class(response_code=e.response_code, errors=e.errors)
-            except AssertionError:
-                # Re-raise for assertions made in unittests
-                raise
             except Exception as e:
-                if self.process_unhandled_exception(e):
+                response = self._exception_response(method_descriptor, e)
+                if response is None:
                     raise
-                response = method_descriptor.response_class(response_code=ResponseCode.SERVER_ERROR)
 
         self.log_response(method_name, request, response)
         return response
 
     def invoke_with_json(self, method_name, json_request):
+        response = self._invoke_with_json(method_name, json_request)
+        return response.to_json() if response else None
+
+    def invoke_with_json_iter(self, method_name, json_request):
+        '''Like invoke_with_json, but returns the response as an iterator of utf-8
+        encoded chunks of JSON, e.g. to be returned as a streaming WSGI response body.'''
+        response = self._invoke_with_json(method_name, json_request)
+        if not response:
+            return iter([b'null'])
+        return (chunk.encode('utf-8') for chunk in response.iter_json())
+
+    def invoke_with_json_stream(self, method_name, fp, iter_field=None):
+        '''Like invoke_with_json, but parses the request from a file-like object (or bytes)
+        with Model.from_json_stream. If iter_field is given, the method receives that
+        request field as an iterator of items parsed as it is consumed. The validators
+        of that field itself, e.g. required=True, are not run, so the method must check
+        for an empty list itself. An invalid item only results in a REQUEST_ERROR response
+        once the method reaches it. Malformed JSON also results in a REQUEST_ERROR response.'''
+        response = self._invoke_with_json(method_name, fp, stream=True, iter_field=iter_field)
+        return response.to_json() if response else None
+
+    def _invoke_with_json(self, method_name, json_request, stream=False, iter_field=None):
+        try:
+            method_descriptor, request, validation_errors = self._parse_request(method_name, json_request, stream, iter_field)
+        except (jsonstream.JsonStreamError, UnicodeDecodeError) as e:
+            # Only raised when reading a stream
+            error_context = validation.ErrorContext()
+            error_context.add_error(validation.CommonErrorCodes.INVALID_VALUE, 'Invalid JSON: %s' % e)
+            return self._request_error_response(self.resolve_method(method_name), error_context.all_errors())
+        if validation_errors:
+            return self._request_error_response(method_descriptor, validation_errors)
+        return self.invoke(method_name, request, already_validated=True)
+
+    # The steps of invoke() and invoke_with_json(), shared with AsyncServiceImplementation
+
+    def _parse_request(self, method_name, json_request, stream=False, iter_field=None):
+        '''Returns the method descriptor, the parsed request and any errors found parsing it'''
         method_descriptor = self.resolve_method(method_name)
-        error_context = validation.ErrorContext()
+        error_context = validation.ErrorContext(max_errors=self.max_request_errors)
         validation_context = validation.ValidationContext(service=self.get_name(), method=method_name)
-        request = method_descriptor.request_class.from_json(json_request, error_context, validation_context)
-        validation_errors = error_context.all_errors()
-        if validation_errors:
-            response = method_descriptor.response_class(
-                response_code=ResponseCode.REQUEST_ERROR,
-                errors=[ApiError(code=ve.code, path=ve.path, message=ve.msg) for ve in validation_errors])
+        if stream:
+            request = method_descriptor.request_class.from_json_stream(
+                json_request, error_context, validation_context, iter_field=iter_field)
         else:
-            response = self.invoke(method_name, request, already_validated=True)
-        return response.to_json() if response else None
+            request = method_descriptor.request_class.from_json(json_request, error_context, validation_context)
+        return method_descriptor, request, error_context.all_errors()
+
+    def _validate_request(self, method_name, request):
+        error_context = validation.ErrorContext(max_errors=self.max_request_errors)
+        validation_context = validation.ValidationContext(service=self.get_name(), method=method_name)
+        request.validate(error_context, validation_context)
+        return error_context.all_errors()
+
+    def _exception_response(self, method_descriptor, e):
+        '''Returns the response for an exception raised by a service method,
+        or None if the exception should be re-raised'''
+        if isinstance(e, ApiException):
+            return method_descriptor.response_class(response_code=e.response_code, errors=e.errors)
+        if isinstance(e, exceptions.StreamDeserializationError):
+            # An item of a request list field streamed with invoke_with_json_stream was invalid
+            return self._request_error_response(method_descriptor, e.errors)
+        if isinstance(e, AssertionError):
+            # Re-raise for assertions made in unittests
+            return None
+        if self.process_unhandled_exception(e):
+            return None
+        return method_descriptor.response_class(response_code=ResponseCode.SERVER_ERROR)
+
+    def _request_error_response(self, method_descriptor, validation_errors):
+        return method_descriptor.response_class(
+            response_code=ResponseCode.REQUEST_ERROR,
+            errors=[ApiError(code=ve.code, path=ve.path, message=ve.msg) for ve in validation_errors])
 
     def resolve_method(self, method_name):
         descriptor = self.methods.get(method_name)
@@ -166,19 +277,69 @@ class ServiceImplementation(Service):
         return True
 
     def log_request(self, method_name, request):
-        logger.debug('API service request: %s.%s\n%s',
-            self.__class__.__name__, method_name, request)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('API service request: %s.%s\n%s',
+                self.__class__.__name__, method_name, _LazyLogValue(_format_model, request, self.max_log_length))
 
     def log_response(self, method_name, request, response):
         if response.response_code == ResponseCode.SERVER_ERROR:
-            logger.error('Server error in API call %s.%s\nRequest:\n%s\nResponse: %s\n%s',
-                self.__class__.__name__,
-                method_name,
-                request.to_json_str() if request else None,
-                response.to_json_str() if response else None,
-                traceback.format_exc() or '')
-        else:
-            logger.debug('API service response:\n%s', response)
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error('Server error in API call %s.%s\nRequest:\n%s\nResponse: %s\n%s',
+                    self.__class__.__name__,
+                    method_name,
+                    _LazyLogValue(_format_model_json, request, self.max_log_length),
+                    _LazyLogValue(_format_model_json, response, self.max_log_length),
+                    _LazyLogValue(_format_exc))
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug('API service response:\n%s', _LazyLogValue(_format_model, response, self.max_log_length))
+
+class HttpTransport(object):
+    '''Sends the requests of RemoteServiceStubs through a requests.Session, which keeps
+    connections to each host alive and reuses them from a pool. A transport may be
+    shared by any number of stubs and threads.
+
+    pool_connections is the number of hosts to keep pools for, and pool_maxsize the
+    number of connections kept open to each host, which should be at least the number
+    of threads making calls. max_retries is an int or a urllib3 Retry. An int only
+    retries failures to connect, since service calls aren't necessarily idempotent.
+    timeout is in seconds, or a (connect, read) tuple, None to wait forever.
+    The session rejects cookies, so that stubs sharing it don't share state.
+    '''
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=0, timeout=None, session=None):
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(http_cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.timeout = timeout
+
+    def post(self, url, data, headers):
+        return self.session.post(url, data=data, headers=headers, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+def get_default_http_transport():
+    '''Returns the transport used by RemoteServiceStubs that aren't given one'''
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = HttpTransport()
+    return _default_transport
+
+def set_default_http_transport(transport):
+    global _default_transport
+    _default_transport = transport
 
 class RemoteServiceStub(Service):
     '''Usage:
@@ -187,14 +348,29 @@ class RemoteServiceStub(Service):
 
     service = RemoteFooService('https://remoteserver.com')
     foo_response = service.foo(FooRequest(...))
+
+    Pass an HttpTransport, or any object with the same post() method, to configure
+    connection pooling, retries and timeouts. Otherwise all stubs share
+    get_default_http_transport().
     '''
-    def __init__(self, base_url):
+    transport = None
+
+    def __init__(self, base_url, transport=None):
         self.base_url = base_url.rstrip('/')
+        self.transport = transport
 
     def _invoke(self, method_descriptor, request):
-        url = '%s%s/%s' % (self.base_url, self.path.rstrip('/'), method_descriptor.name)
-        response = requests.post(url, data=request.to_json_str(), headers={'Content-Type': 'application/json'})
-        return method_descriptor.response_class.from_json(response.json())
+        json_backend = jsonbackend.get_json_backend(self.json_backend)
+        transport = self.transport or get_default_http_transport()
+        response = transport.post(self._method_url(method_descriptor), data=json_backend.dumps(request.to_json()), headers=_JSON_HEADERS)
+        if isinstance(json_backend, jsonbackend.StdlibJsonBackend):
+            response_json = response.json()
+        else:
+            response_json = json_backend.loads(response.content)
+        return method_descriptor.response_class.from_json(response_json)
+
+    def _method_url(self, method_descriptor):
+        return '%s%s/%s' % (self.base_url, self.path.rstrip('/'), method_descriptor.name)
 
     def __getattr__(self, method_name):
         descriptor = self.methods.get(method_name)
@@ -3,12 +3,19 @@ import collections
 import re
 import six
 
+from . import exceptions
+
 class Validator(object):
     documentation = ''
 
     def validate(self, value, error_context, context):
         return value
 
+    def applies_to(self, service, method, operator):
+        # Validators that only run for some methods override this, which lets
+        # models skip them entirely for the other methods
+        return True
+
     def get_documentation(self):
         return self.documentation
 
@@ -22,40 +29,81 @@ class ValidationError(object):
         return '%s: %s at "%s" - %s' % (self.__class__.__name__, self.code, self.path, self.msg)
 
 class ErrorContext(object):
-    def __init__(self, path=''):
-        self.path = path
+    # Contexts are created for every field, list index and dict key visited
+    # during parsing and validation, and nearly all of them never see an error.
+    # So a child context only records its parent and its own path segment,
+    # renders its path the first time an error is added, and is only attached
+    # to its parent's children once it has an error.
+    # A root context created with max_errors raises ErrorLimitReached once
+    # that many errors have been added anywhere beneath it, so that malformed
+    # payloads can be rejected without walking the rest of them.
+    __slots__ = ('_path', '_path_format', '_path_value', 'parent', 'errors', 'children', 'error_count', 'max_errors')
+
+    FIELD_PATH_FORMAT = '%s.%s'
+    INDEX_PATH_FORMAT = '%s[%d]'
+    KEY_PATH_FORMAT = '%s["%s"]'
+
+    def __init__(self, path='', parent=None, path_format=None, path_value=None, max_errors=None):
+        self._path = path if parent is None else None
+        self.max_errors = max_errors
+        self._path_format = path_format
+        self._path_value = path_value
+        self.parent = parent
         self.errors = []
         self.children = []
+        # Number of errors in this context and all of its descendants
+        self.error_count = 0
+
+    @property
+    def path(self):
+        if self._path is None:
+            parent_path = self.parent.path
+            if self._path_format is self.FIELD_PATH_FORMAT and not parent_path:
+                self._path = self._path_value
+            else:
+                self._path = self._path_format % (parent_path, self._path_value)
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        self._path = path
 
     def add_error(self, error_code, error_msg):
         self.errors.append(ValidationError(self.path, error_code, error_msg))
+        ec = self
+        while ec.parent is not None:
+            ec.error_count += 1
+            if ec.error_count == 1:
+                # First error anywhere under this context
+                ec.parent.children.append(ec)
+            ec = ec.parent
+        ec.error_count += 1
+        if ec.max_errors is not None and ec.error_count >= ec.max_errors:
+            raise exceptions.ErrorLimitReached(ec)
         return self
 
     # Use exactly on keyword argument
     def extend(self, field=None, index=None, key=None):
         if field:
-            if self.path:
-                path = '%s.%s' % (self.path, field)
-            else:
-                path = field
+            return ErrorContext(parent=self, path_format=self.FIELD_PATH_FORMAT, path_value=field)
         elif index is not None:
-            path = '%s[%d]' % (self.path, index)
+            return ErrorContext(parent=self, path_format=self.INDEX_PATH_FORMAT, path_value=index)
         elif key is not None:
-            path = '%s["%s"]' % (self.path, key)
-        else:
-            raise TypeError('Must specify exactly one keyword arg of either field=, index=, or key=')
-        ec = ErrorContext(path)
-        self.children.append(ec)
-        return ec
+            return ErrorContext(parent=self, path_format=self.KEY_PATH_FORMAT, path_value=key)
+        raise TypeError('Must specify exactly one keyword arg of either field=, index=, or key=')
 
     def all_errors(self):
-        errors = self.errors[:]
-        for child in self.children:
-            errors.extend(child.all_errors())
+        errors = []
+        self._collect_errors(errors)
         return errors
 
+    def _collect_errors(self, errors):
+        errors.extend(self.errors)
+        for child in self.children:
+            child._collect_errors(errors)
+
     def has_errors(self):
-        return bool(self.all_errors())
+        return self.error_count > 0
 
     def __str__(self):
         return '<%s: %s>' % (type(self).__name__, ', '.join(str(e) for e in self.all_errors()))
@@ -110,6 +158,9 @@ class MethodMatcher(object):
                     raise InvalidMethodSpec(method_name)
                 service_method = self.ServiceMethod(service=match.group(2), method=match.group(3), operator=match.group(5))
                 self.service_methods.append(service_method)
+        # Specs omitting the service or operator are stored with None in that
+        # position, so matching is a handful of set lookups
+        self._specs = frozenset(self.service_methods or ())
 
     def for_all_methods(self):
         return self.all
@@ -122,9 +173,12 @@ class MethodMatcher(object):
             return True
         if not (service or method or operator):
             return False
-        for service_method in self.service_methods:
-            if (service_method.method == method
-                and (service_method.service == service or service_method.service is None)
-                and (service_method.operator == operator or service_method.operator is None)):
-                return True
-        return False
+        specs = self._specs
+        try:
+            return ((service, method, operator) in specs
+                or (None, method, operator) in specs
+                or (service, method, None) in specs
+                or (None, method, None) in specs)
+        except TypeError:
+            # An unhashable operator can never equal a spec's operator
+            return (service, method, None) in specs or (None, method, None) in specs
@@ -19,6 +19,9 @@ class Required(Validator):
             return 'Value is required'
         return 'Value is required for methods: %s' % ', '.join(self.method_matcher.methods())
 
+    def applies_to(self, service, method, operator):
+        return self.method_matcher.matches(service, method, operator)
+
     def validate(self, value, error_context, context):
         if value in EMPTY_VALUES:
             if self.method_matcher.matches(context.service, context.method, context.operator):
@@ -42,6 +45,9 @@ class Readonly(Validator):
             return 'Value is read-only'
         return 'Value is read-only for method(s): %s' % ', '.join(self.method_matcher.methods())
 
+    def applies_to(self, service, method, operator):
+        return self.method_matcher.matches(service, method, operator)
+
     def validate(self, value, error_context, context):
         if self.method_matcher.matches(context.service, context.method, context.operator):
             return None
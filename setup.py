@@ -9,6 +9,6 @@ setup(
     version='0.3.0',
     packages=find_packages(),
     install_requires=['six', 'python-dateutil', 'requests'],
-    extras_require={'encrypted-ids': ['hashids']},
+    extras_require={'encrypted-ids': ['hashids'], 'fast-json': ['orjson'], 'async': ['aiohttp']},
     tests_require=['mock'],
     test_suite='tests.all_tests')
@@ -0,0 +1,318 @@
+from __future__ import absolute_import
+
+import asyncio
+import json
+import unittest
+
+import mock
+
+import apilib
+
+class FooRequest(apilib.Request):
+    request_str = apilib.Field(apilib.String())
+
+class FooResponse(apilib.Response):
+    response_str = apilib.Field(apilib.String())
+
+class FooService(apilib.Service):
+    methods = apilib.servicemethods(
+        apilib.Meth('foo', FooRequest, FooResponse))
+    path = '/foo_service'
+
+class AsyncRemoteFooService(FooService, apilib.AsyncRemoteServiceStub):
+    pass
+
+class EchoServer(object):
+    '''An HTTP server answering each POST with the request_str it was sent'''
+
+    def __init__(self, chunked=False, requests_per_connection=None, delay=0):
+        self.chunked = chunked
+        self.requests_per_connection = requests_per_connection
+        self.delay = delay
+        self.connections = 0
+        self.requests = []
+        self._handlers = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return 'http://127.0.0.1:%d' % self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+        self.connections += 1
+        handled = 0
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers['content-length']))
+            self.requests.append((request_line.decode('latin-1').strip(), headers, body))
+            await asyncio.sleep(self.delay)
+
+            content = json.dumps({
+                'response_code': 'SUCCESS',
+                'response_str': json.loads(body.decode('utf-8'))['request_str'],
+            }).encode('utf-8')
+            if self.chunked:
+                head = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                middle = len(content) // 2
+                content = b''.join(b'%x\r\n%s\r\n' % (len(part), part) for part in (content[:middle], content[middle:])) + b'0\r\n\r\n'
+            else:
+                head = b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(content)
+            writer.write(head + content)
+            await writer.drain()
+            handled += 1
+            if handled == self.requests_per_connection:
+                break
+        writer.close()
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class AsyncRemoteServiceTest(unittest.TestCase):
+    def call(self, server, requests, **transport_kwargs):
+        async def call():
+            base_url = await server.start()
+            transport = apilib.StreamsHttpTransport(**transport_kwargs)
+            service = AsyncRemoteFooService(base_url + '/', transport=transport)
+            try:
+                return await asyncio.gather(*[service.foo(request) for request in requests])
+            finally:
+                await transport.close()
+                await server.stop()
+        return run(call())
+
+    def test_remote_request(self):
+        server = EchoServer()
+        responses = self.call(server, [FooRequest(request_str='blah')])
+        self.assertEqual({'response_code': 'SUCCESS', 'response_str': 'blah', 'errors': None}, responses[0].to_json())
+
+        request_line, headers, body = server.requests[0]
+        self.assertEqual('POST /foo_service/foo HTTP/1.1', request_line)
+        self.assertEqual('application/json', headers['content-type'])
+        self.assertEqual({'request_str': 'blah'}, json.loads(body.decode('utf-8')))
+
+    def test_connections_reused(self):
+        server = EchoServer()
+        async def call():
+            base_url = await server.start()
+            service = AsyncRemoteFooService(base_url, transport=apilib.StreamsHttpTransport())
+            try:
+                for i in range(5):
+                    response = await service.foo(FooRequest(request_str=str(i)))
+                    self.assertEqual(str(i), response.response_str)
+            finally:
+                await service.transport.close()
+                await server.stop()
+        run(call())
+        self.assertEqual(5, len(server.requests))
+        self.assertEqual(1, server.connections)
+
+    def test_concurrent_requests(self):
+        server = EchoServer(delay=0.01)
+        requests = [FooRequest(request_str=str(i)) for i in range(50)]
+        responses = self.call(server, requests, max_connections=10)
+        self.assertEqual([str(i) for i in range(50)], [r.response_str for r in responses])
+        self.assertEqual(10, server.connections)
+
+    def test_chunked_response(self):
+        responses = self.call(EchoServer(chunked=True), [FooRequest(request_str='blah')])
+        self.assertEqual('blah', responses[0].response_str)
+
+    def test_closed_connections_replaced(self):
+        server = EchoServer(requests_per_connection=1)
+        async def call():
+            base_url = await server.start()
+            service = AsyncRemoteFooService(base_url, transport=apilib.StreamsHttpTransport())
+            try:
+                for i in range(3):
+                    response = await service.foo(FooRequest(request_str=str(i)))
+                    self.assertEqual(str(i), response.response_str)
+                    await asyncio.sleep(0.01)
+            finally:
+                await service.transport.close()
+                await server.stop()
+        run(call())
+        self.assertEqual(3, server.connections)
+
+    def test_timeout(self):
+        server = EchoServer(delay=1)
+        with self.assertRaises(asyncio.TimeoutError):
+            self.call(server, [FooRequest(request_str='blah')], timeout=0.05)
+
+    def test_default_transport(self):
+        async def call():
+            return apilib.get_default_async_http_transport(), apilib.get_default_async_http_transport()
+        transport, transport2 = run(call())
+        self.assertIs(transport, transport2)
+
+    @mock.patch('apilib.aio.aiohttp')
+    def test_aiohttp_session_rejects_cookies(self, mock_aiohttp):
+        response = mock_aiohttp.ClientSession.return_value.post.return_value.__aenter__.return_value
+        response.status = 200
+        response.read = mock.AsyncMock(return_value=b'{}')
+        transport = apilib.AiohttpTransport()
+        self.assertEqual(b'{}', run(transport.post('http://localhost:5000/foo_service/foo', b'{}', {})).content)
+        session_kwargs = mock_aiohttp.ClientSession.call_args[1]
+        self.assertIs(mock_aiohttp.DummyCookieJar.return_value, session_kwargs['cookie_jar'])
+
+    def test_close_default_transport(self):
+        async def call():
+            transport = apilib.get_default_async_http_transport()
+            with mock.patch.object(transport, 'close', wraps=transport.close) as close:
+                await apilib.close_default_async_http_transport()
+                await apilib.close_default_async_http_transport()
+            self.assertEqual(1, close.call_count)
+            self.assertIsNot(transport, apilib.get_default_async_http_transport())
+            await apilib.close_default_async_http_transport()
+        run(call())
+
+    def test_unknown_method(self):
+        service = AsyncRemoteFooService('http://localhost:5000')
+        with self.assertRaises(apilib.MethodNotFoundException):
+            service.unknown(FooRequest(request_str='blah'))
+
+class AsyncFooServiceImpl(FooService, apilib.AsyncServiceImplementation):
+    async def foo(self, request):
+        await asyncio.sleep(0)
+        if request.request_str == 'api error':
+            raise apilib.ApiException.request_error(error_msgs=['Bad request'])
+        if request.request_str == 'crash':
+            raise ValueError('Crashed')
+        return FooResponse(response_str='Your request string was: %s' % request.request_str)
+
+    def process_unhandled_exception(self, exception):
+        return False
+
+class StrictFooRequest(apilib.Request):
+    request_str = apilib.Field(apilib.String(), required=True)
+
+class SyncFooServiceImpl(apilib.AsyncServiceImplementation):
+    methods = apilib.servicemethods(
+        apilib.Meth('foo', StrictFooRequest, FooResponse),
+        apilib.Meth('unimplemented', StrictFooRequest, FooResponse))
+    path = '/sync_foo_service/'
+
+    def foo(self, request):
+        return FooResponse(response_str=request.request_str)
+
+class AsyncServiceImplementationTest(unittest.TestCase):
+    def test_coroutine_method(self):
+        response = run(AsyncFooServiceImpl().ainvoke('foo', FooRequest(request_str='blah')))
+        self.assertEqual('SUCCESS', response.response_code)
+        self.assertEqual('Your request string was: blah', response.response_str)
+
+        response = run(AsyncFooServiceImpl().ainvoke_with_json('foo', {'request_str': 'blah'}))
+        self.assertEqual({'response_code': 'SUCCESS', 'response_str': 'Your request string was: blah'}, response)
+
+    def test_regular_method(self):
+        response = run(SyncFooServiceImpl().ainvoke_with_json('foo', {'request_str': 'blah'}))
+        self.assertEqual({'response_code': 'SUCCESS', 'response_str': 'blah'}, response)
+
+    def test_validation(self):
+        response = run(SyncFooServiceImpl().ainvoke_with_json('foo', {}))
+        self.assertEqual('REQUEST_ERROR', response['response_code'])
+        self.assertEqual(['request_str'], [e['path'] for e in response['errors']])
+
+        response = run(SyncFooServiceImpl().ainvoke('foo', StrictFooRequest()))
+        self.assertEqual('REQUEST_ERROR', response.response_code)
+
+        response = run(SyncFooServiceImpl().ainvoke_with_json('foo', {'unknown': 1, 'request_str': 'a'}))
+        self.assertEqual(['unknown'], [e['path'] for e in response['errors']])
+
+    def test_exceptions(self):
+        response = run(AsyncFooServiceImpl().ainvoke_with_json('foo', {'request_str': 'api error'}))
+        self.assertEqual('REQUEST_ERROR', response['response_code'])
+        self.assertEqual(['Bad request'], [e['message'] for e in response['errors']])
+
+        response = run(AsyncFooServiceImpl().ainvoke_with_json('foo', {'request_str': 'crash'}))
+        self.assertEqual({'response_code': 'SERVER_ERROR'}, response)
+
+        class RaisingFooServiceImpl(AsyncFooServiceImpl):
+            def process_unhandled_exception(self, exception):
+                return True
+        with self.assertRaises(ValueError):
+            run(RaisingFooServiceImpl().ainvoke_with_json('foo', {'request_str': 'crash'}))
+
+        with self.assertRaises(apilib.MethodNotImplementedException):
+            run(SyncFooServiceImpl().ainvoke_with_json('unimplemented', {}))
+
+class AsgiServiceAppTest(unittest.TestCase):
+    def request(self, path, body=b'', method='POST'):
+        app = apilib.AsgiServiceApp([AsyncFooServiceImpl(), SyncFooServiceImpl()])
+        scope = {'type': 'http', 'method': method, 'path': path}
+        # The body arrives in two parts
+        messages = [
+            {'type': 'http.request', 'body': body[:5], 'more_body': True},
+            {'type': 'http.request', 'body': body[5:]},
+        ]
+        sent = []
+        async def receive():
+            return messages.pop(0)
+        async def send(message):
+            sent.append(message)
+        run(app(scope, receive, send))
+        headers = dict(sent[0]['headers'])
+        self.assertEqual(str(len(sent[1]['body'])).encode('ascii'), headers[b'content-length'])
+        return sent[0]['status'], headers[b'content-type'], sent[1]['body']
+
+    def test_request(self):
+        status, content_type, body = self.request('/foo_service/foo', b'{"request_str": "blah"}')
+        self.assertEqual(200, status)
+        self.assertEqual(b'application/json', content_type)
+        self.assertEqual({'response_code': 'SUCCESS', 'response_str': 'Your request string was: blah'}, json.loads(body.decode('utf-8')))
+
+        status, _, body = self.request('/sync_foo_service/foo', b'{}')
+        self.assertEqual(200, status)
+        self.assertEqual('REQUEST_ERROR', json.loads(body.decode('utf-8'))['response_code'])
+
+    def test_errors(self):
+        self.assertEqual(404, self.request('/bar_service/foo')[0])
+        self.assertEqual(404, self.request('/foo_service/bar')[0])
+        self.assertEqual(404, self.request('/sync_foo_service/unimplemented', b'{"request_str": "a"}')[0])
+        self.assertEqual(405, self.request('/foo_service/foo', method='GET')[0])
+        self.assertEqual(400, self.request('/foo_service/foo', b'{"request_str"')[0])
+        for body in (b'[1]', b'"x"', b'null', b'1', b'true'):
+            self.assertEqual((400, b'The request must be a JSON object'), self.request('/foo_service/foo', body)[::2])
+
+    def test_lifespan(self):
+        app = apilib.AsgiServiceApp([])
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+        async def receive():
+            return messages.pop(0)
+        async def send(message):
+            sent.append(message['type'])
+        run(app({'type': 'lifespan'}, receive, send))
+        self.assertEqual(['lifespan.startup.complete', 'lifespan.shutdown.complete'], sent)
+
+    def test_service_without_path(self):
+        class PathlessServiceImpl(apilib.AsyncServiceImplementation):
+            pass
+        self.assertRaises(apilib.ConfigurationRequired, apilib.AsgiServiceApp, [PathlessServiceImpl()])
+
+    def test_sync_service_implementation(self):
+        class BlockingFooServiceImpl(FooService, apilib.ServiceImplementation):
+            def foo(self, request):
+                return FooResponse()
+        with self.assertRaises(apilib.ConfigurationRequired) as context:
+            apilib.AsgiServiceApp([AsyncFooServiceImpl(), BlockingFooServiceImpl()])
+        self.assertIn('BlockingFooServiceImpl must be an AsyncServiceImplementation', str(context.exception))
@@ -0,0 +1,12 @@
+from __future__ import absolute_import
+
+import sys
+import unittest
+
+# The asyncio tests are kept in a module that test discovery doesn't pick up,
+# since Python 2 can't compile them. They also use asyncio.current_task().
+if sys.version_info >= (3, 7):
+    from .aio_cases import *
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+
+import threading
+import unittest
+
+import apilib
+
+class LRUCacheTest(unittest.TestCase):
+    def test_get_and_put(self):
+        cache = apilib.LRUCache(2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, cache.get('a', 0))
+        cache.put('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(2, cache.misses)
+
+    def test_get_many_and_put_many(self):
+        cache = apilib.LRUCache(3)
+        cache.put_many([('a', 1), ('b', 2)])
+        self.assertEqual([1, None, 2], cache.get_many(['a', 'c', 'b']))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+        # 'a' was used before 'b', so is evicted first
+        cache.put_many([('c', 3), ('d', 4)])
+        self.assertEqual([0, 2, 3, 4], cache.get_many(['a', 'b', 'c', 'd'], 0))
+
+    def test_least_recently_used_evicted(self):
+        cache = apilib.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+        cache.maxsize = 1
+        cache.put('d', 4)
+        self.assertEqual(['d'], [key for key in 'abcd' if key in cache])
+
+    def test_disabled(self):
+        cache = apilib.LRUCache(0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, len(cache))
+
+    def test_clear(self):
+        cache = apilib.LRUCache(2)
+        cache.put('a', 1)
+        cache.get('a')
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.hits)
+
+    def test_concurrent_use(self):
+        cache = apilib.LRUCache(10)
+        def use():
+            for i in range(1000):
+                cache.put(i % 20, i)
+                cache.get((i + 1) % 20)
+        threads = [threading.Thread(target=use) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(10, len(cache))
+        self.assertEqual(8000, cache.hits + cache.misses)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+from __future__ import absolute_import
+
+import unittest
+
+import apilib
+
+class FeistelIdCipherTest(unittest.TestCase):
+    def test_round_trip(self):
+        cipher = apilib.FeistelIdCipher('test')
+        for value in (0, 1, 123, 2 ** 32, apilib.FeistelIdCipher.max_id):
+            encoded = cipher.encode(value)
+            self.assertEqual(11, len(encoded))
+            self.assertTrue(encoded.isalnum())
+            self.assertEqual(value, cipher.decode(encoded))
+
+    def test_stable_for_a_key(self):
+        self.assertEqual(apilib.FeistelIdCipher('test').encode(123), apilib.FeistelIdCipher(u'test').encode(123))
+        self.assertNotEqual(apilib.FeistelIdCipher('test').encode(123), apilib.FeistelIdCipher('other').encode(123))
+        self.assertNotEqual(apilib.FeistelIdCipher('test').encode(123), apilib.FeistelIdCipher('test').encode(124))
+
+    def test_out_of_range(self):
+        cipher = apilib.FeistelIdCipher('test')
+        self.assertRaises(ValueError, cipher.encode, -1)
+        self.assertRaises(ValueError, cipher.encode, apilib.FeistelIdCipher.max_id + 1)
+
+    def test_invalid_ids(self):
+        cipher = apilib.FeistelIdCipher('test')
+        encoded = cipher.encode(123)
+        self.assertIsNone(apilib.FeistelIdCipher('other').decode(encoded))
+        self.assertIsNone(cipher.decode(encoded[:-1]))
+        self.assertIsNone(cipher.decode(encoded[:-1] + '-'))
+        self.assertIsNone(cipher.decode('zzzzzzzzzzz'))
+        self.assertIsNone(cipher.decode(''))
+
+if __name__ == '__main__':
+    unittest.main()
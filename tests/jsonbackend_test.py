@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import json
+import unittest
+
+from dateutil import tz
+
+import apilib
+
+class Primitives(apilib.Model):
+    fany = apilib.Field(apilib.AnyPrimitive())
+    fstring = apilib.Field(apilib.String())
+    fdecimal = apilib.Field(apilib.Decimal())
+    fdatetime = apilib.Field(apilib.DateTime())
+
+AVAILABLE_BACKENDS = [name for name, module in (
+    ('json', json),
+    ('orjson', apilib.jsonbackend.orjson),
+    ('simplejson', apilib.jsonbackend.simplejson),
+    ('ujson', apilib.jsonbackend.ujson)) if module]
+
+class JsonBackendTest(unittest.TestCase):
+    def test_default_output_unchanged(self):
+        m = Primitives(fany={'a': [1, 2.5, None]}, fstring=u'é')
+        self.assertEqual(json.dumps(m.to_json()), m.to_json_str())
+        self.assertIs(apilib.get_json_backend('json'), apilib.get_json_backend())
+
+    def test_backends_round_trip(self):
+        m = Primitives(
+            fany={'a': [1, 2.5, None, True], 'b': u'é'},
+            fstring=None,
+            fdecimal=decimal.Decimal('1.10'),
+            fdatetime=datetime.datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=tz.tzutc()))
+        for name in AVAILABLE_BACKENDS:
+            json_str = m.to_json_str(name)
+            self.assertEqual(m.to_json(), json.loads(json_str))
+            self.assertEqual(m, Primitives.from_json_str(json_str, json_backend=name))
+            self.assertEqual(m, Primitives.from_json_str(json_str.encode('utf-8'), json_backend=name))
+
+    def test_values_encoded_like_field_types(self):
+        value = [decimal.Decimal('1.10'), datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=tz.tzutc()),
+            datetime.date(2020, 1, 2), b'abc']
+        expected = [u'1.10', u'2020-01-02T03:04:05+00:00', u'2020-01-02', u'abc']
+        for name in AVAILABLE_BACKENDS:
+            self.assertEqual(expected, json.loads(Primitives(fany=value).to_json_str(name))['fany'])
+
+    def test_unserializable_value(self):
+        for name in AVAILABLE_BACKENDS:
+            with self.assertRaises(TypeError):
+                Primitives(fany=object()).to_json_str(name)
+
+    def test_auto(self):
+        expected = [name for name in apilib.AUTO_JSON_BACKENDS if name in AVAILABLE_BACKENDS][0]
+        self.assertIs(apilib.get_json_backend(expected), apilib.get_json_backend('auto'))
+
+    def test_set_json_backend(self):
+        try:
+            apilib.set_json_backend('auto')
+            self.assertIs(apilib.get_json_backend('auto'), apilib.get_json_backend())
+        finally:
+            apilib.set_json_backend('json')
+        with self.assertRaises(apilib.ConfigurationRequired):
+            apilib.set_json_backend('unknown')
+        self.assertIs(apilib.get_json_backend('json'), apilib.get_json_backend())
+
+    @unittest.skipIf(apilib.jsonbackend.ujson, 'ujson is installed')
+    def test_missing_module(self):
+        with self.assertRaises(apilib.ModuleRequired):
+            apilib.get_json_backend('ujson')
+
+if __name__ == '__main__':
+    unittest.main()
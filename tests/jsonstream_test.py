@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+
+import io
+import json
+import unittest
+
+import apilib
+
+class Item(apilib.Model):
+    fstring = apilib.Field(apilib.String(), required=True)
+    fint = apilib.Field(apilib.Integer())
+
+class Batch(apilib.Model):
+    name = apilib.Field(apilib.String())
+    items = apilib.Field(apilib.ListType(Item), required=True)
+    tags = apilib.Field(apilib.ListType(apilib.String()))
+
+class Selection(apilib.Model):
+    name = apilib.Field(apilib.String(), validators=[apilib.AtMostOneNonempty('name', 'items')])
+    items = apilib.Field(apilib.ListType(Item), validators=[apilib.ExactlyOneNonempty('items', 'ids')])
+    ids = apilib.Field(apilib.ListType(apilib.Integer()), validators=[apilib.ExactlyOneNonempty('items', 'ids')])
+
+class JsonStreamReaderTest(unittest.TestCase):
+    DATA = {'a': [1.5e10, -2, 'x' * 100, {'b': [None, True, False]}], 'c': u'é' * 50, 'n': 12345678901234567890}
+
+    def read(self, reader):
+        result = {}
+        for key in reader.iter_object():
+            result[key] = list(reader.iter_array()) if key == 'a' else reader.read_value()
+        reader.end()
+        return result
+
+    def test_small_reads(self):
+        for read_size in (1, 2, 3, 7, 1024):
+            for ensure_ascii in (True, False):
+                data = json.dumps(self.DATA, ensure_ascii=ensure_ascii).encode('utf-8')
+                self.assertEqual(self.DATA, self.read(apilib.JsonStreamReader(io.BytesIO(data), read_size)))
+
+    def test_sources(self):
+        text = json.dumps(self.DATA)
+        self.assertEqual(self.DATA, self.read(apilib.JsonStreamReader(text)))
+        self.assertEqual(self.DATA, self.read(apilib.JsonStreamReader(text.encode('utf-8'))))
+        self.assertEqual(self.DATA, self.read(apilib.JsonStreamReader(io.StringIO(text), 5)))
+
+    def test_empty_containers(self):
+        reader = apilib.JsonStreamReader(' { "a" : [ ] , "b": {} } ')
+        keys = reader.iter_object()
+        self.assertEqual('a', next(keys))
+        self.assertEqual([], list(reader.iter_array()))
+        self.assertEqual('b', next(keys))
+        self.assertEqual([], list(reader.iter_object()))
+        self.assertEqual([], list(keys))
+        reader.end()
+
+    def test_invalid(self):
+        with self.assertRaises(apilib.JsonStreamError):
+            self.read(apilib.JsonStreamReader('{"a": [1, 2'))
+        with self.assertRaises(apilib.JsonStreamError):
+            self.read(apilib.JsonStreamReader('{"c": 1} 2'))
+        with self.assertRaises(apilib.JsonStreamError):
+            self.read(apilib.JsonStreamReader('{"c": tru}'))
+        with self.assertRaises(ValueError):
+            apilib.JsonStreamReader(b'"\xc3').read_value()
+
+class FromJsonStreamTest(unittest.TestCase):
+    OBJ = {'name': 'batch', 'items': [{'fstring': 'a', 'fint': 1}, {'fstring': 'b'}], 'tags': ['x']}
+
+    def test_matches_from_json(self):
+        for obj in (self.OBJ, {'items': []}, {'items': None, 'name': None}, {}):
+            self.assertEqual(Batch.from_json(obj), Batch.from_json_stream(json.dumps(obj)))
+        self.assertIsNone(Batch.from_json_stream(io.BytesIO(b'null')))
+
+    def test_errors(self):
+        obj = {'items': [{'fstring': 'a'}, {'fint': 'b'}], 'unknown': 1}
+        with self.assertRaises(apilib.exceptions.DeserializationError) as e:
+            Batch.from_json_stream(json.dumps(obj), context=apilib.ValidationContext())
+        self.assertEqual(['items[1].fint', 'items[1].fstring', 'unknown'], sorted(err.path for err in e.exception.errors))
+
+        with self.assertRaises(apilib.exceptions.DeserializationError) as e:
+            Batch.from_json_stream(json.dumps({'items': [{'fint': 'b'}] * 10}), max_errors=3)
+        self.assertEqual(3, len(e.exception.errors))
+
+        with self.assertRaises(apilib.exceptions.DeserializationError) as e:
+            Batch.from_json_stream('{}', context=apilib.ValidationContext())
+        self.assertEqual(['items'], [err.path for err in e.exception.errors])
+
+    def test_iter_field(self):
+        batch = Batch.from_json_stream(json.dumps(self.OBJ, sort_keys=True).encode('utf-8'), iter_field='tags')
+        self.assertEqual([Item(fstring='a', fint=1), Item(fstring='b', fint=None)], batch.items)
+        self.assertEqual(['x'], list(batch.tags))
+
+        stream = io.BytesIO(b'{"name": "batch", "items": [{"fstring": "a"}, {"fstring": "b"}]}')
+        batch = Batch.from_json_stream(stream, iter_field='items')
+        self.assertEqual('batch', batch.name)
+        self.assertEqual('a', next(batch.items).fstring)
+        self.assertEqual(['b'], [item.fstring for item in batch.items])
+
+    def test_iter_field_errors(self):
+        batch = Batch.from_json_stream('{"items": [{"fstring": "a"}, {"fint": "b"}]}',
+            context=apilib.ValidationContext(), iter_field='items')
+        items = batch.items
+        self.assertEqual('a', next(items).fstring)
+        with self.assertRaises(apilib.exceptions.StreamDeserializationError) as e:
+            next(items)
+        self.assertEqual(['items[1].fint', 'items[1].fstring'], sorted(err.path for err in e.exception.errors))
+
+        batch = Batch.from_json_stream('{"items": [], "name": "a"}', iter_field='items')
+        with self.assertRaises(apilib.exceptions.StreamDeserializationError) as e:
+            list(batch.items)
+        self.assertEqual(['items'], [err.path for err in e.exception.errors])
+
+        with self.assertRaises(apilib.exceptions.DeserializationError) as e:
+            Batch.from_json_stream('{"items": [{"fstring": "a"', iter_field='items')
+        self.assertEqual(['items'], [err.path for err in e.exception.errors])
+
+        with self.assertRaises(apilib.UnknownFieldException):
+            Batch.from_json_stream('{}', iter_field='unknown')
+        with self.assertRaises(apilib.exceptions.ApilibException):
+            Batch.from_json_stream('{}', iter_field='name')
+
+    def test_validators_see_streamed_lists(self):
+        context = apilib.ValidationContext(service='s', method='get')
+        for body in ('{"items": [{"fstring": "a"}]}', '{"ids": [1], "items": []}', '{"ids": [1], "name": "a"}'):
+            self.assertEqual(Selection.from_json(json.loads(body), context=context), Selection.from_json_stream(body, context=context))
+            items = Selection.from_json_stream(body, context=context, iter_field='items').items
+            self.assertEqual(Selection.from_json(json.loads(body)).items, list(items) if items is not None else None)
+
+        for body, errors in (
+                ('{"ids": [1], "items": [{"fstring": "a"}]}', ['ids', 'items']),
+                ('{"ids": [], "items": []}', ['ids', 'items']),
+                ('{"name": "a", "items": [{"fstring": "a"}]}', ['name'])):
+            for iter_field in (None, 'items'):
+                with self.assertRaises(apilib.exceptions.DeserializationError) as e:
+                    Selection.from_json_stream(body, context=context, iter_field=iter_field)
+                # The iterated field's own validators aren't run
+                self.assertEqual([path for path in errors if path != iter_field], sorted(err.path for err in e.exception.errors))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,14 @@ from __future__ import absolute_import
 
 import datetime
 import decimal
+import json
+import pickle
+import threading
 import unittest
 
+from dateutil import parser as dateutil_parser
 from dateutil import tz
+import mock
 import six
 
 import apilib
@@ -421,6 +426,57 @@ class DateFieldTest(unittest.TestCase):
                 datetime.datetime(2013, 2, 12, 14, 29, 0, tzinfo=tz.gettz('America/New_York'))],
             m.ldatetime)
 
+class DateTimeParsingTest(unittest.TestCase):
+    def parse(self, value):
+        error_context = apilib.ErrorContext()
+        dt = apilib.DateTime().from_json(value, error_context)
+        return dt if not error_context.has_errors() else 'error'
+
+    def test_matches_dateutil(self):
+        for value in (u'2012-04-12T10:08:23', u'2012-04-12T10:08:23Z', u'2012-04-12T10:08:23+00:00',
+                u'2012-04-12T10:08:23-00:00', u'2012-04-12T10:08:23.5+05:30', u'2012-04-12T10:08:23.000123-07:00',
+                u'2012-02-29T23:59:59.999999Z'):
+            dt = self.parse(value)
+            expected = dateutil_parser.parse(value)
+            self.assertEqual(expected, dt)
+            self.assertEqual(expected.utcoffset(), dt.utcoffset())
+            self.assertEqual(expected.microsecond, dt.microsecond)
+
+    def test_tzinfo_shared(self):
+        self.assertIs(self.parse(u'2012-04-12T10:08:23-07:00').tzinfo, self.parse(u'2013-01-01T00:00:00-07:00').tzinfo)
+        self.assertIs(self.parse(u'2012-04-12T10:08:23Z').tzinfo, self.parse(u'2012-04-12T10:08:23+00:00').tzinfo)
+        self.assertEqual(tz.tzutc(), self.parse(u'2012-04-12T10:08:23Z').tzinfo)
+
+    def test_invalid(self):
+        for value in (u'2012-02-30T10:08:23', u'2012-04-12T24:00:00', u'2012-04-12 10:08:23', u'2012-04-12T10:08',
+                u'2012-04-12T10:08:23.1234567', u'2012-04-12T10:08:23+0700', u'2012-04-12'):
+            self.assertEqual('error', self.parse(value))
+
+    def test_without_dateutil(self):
+        with mock.patch.object(apilib.model, 'dateutil_parser', None):
+            self.assertEqual('error', self.parse(u'2012-02-30T10:08:23'))
+            self.assertEqual(datetime.datetime(2012, 4, 12, 10, 8, 23, tzinfo=tz.tzutc()), self.parse(u'2012-04-12T10:08:23Z'))
+
+class DateParsingTest(unittest.TestCase):
+    def test_matches_strptime(self):
+        for value in (u'2016-02-18', u'2016-2-8', u'2016-02- 8', u'2016-12-31', u'2016-02-30', u'2016-13-01',
+                u'0000-01-01', u'2016-01-011', u'20161-01-01', u'2016-01-02 ', u'2016-00-10', u'2016-01-00', u'16-01-01'):
+            try:
+                expected = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                expected = None
+            apilib.Date.cache.clear()
+            error_context = apilib.ErrorContext()
+            self.assertEqual(expected, apilib.Date().from_json(value, error_context))
+            self.assertEqual(expected is None, error_context.has_errors())
+
+    def test_cached(self):
+        apilib.Date.cache.clear()
+        m = ModelWithDateList.from_json({'ldate': [u'2016-03-10', u'2016-03-10', u'2016-03-11']})
+        self.assertEqual([datetime.date(2016, 3, 10), datetime.date(2016, 3, 10), datetime.date(2016, 3, 11)], m.ldate)
+        self.assertEqual(1, apilib.Date.cache.hits)
+        self.assertEqual(2, len(apilib.Date.cache))
+
 class ModelWithExtendedFields(apilib.Model):
     fdecimal = apilib.Field(apilib.Decimal())
     fenum = apilib.Field(apilib.Enum(['Jerry', 'George']))
@@ -464,6 +520,144 @@ class ExtendedFieldsTest(unittest.TestCase):
         self.assertEqual('Jerry', m.fenum)
         self.assertEqual(123, m.fid)
 
+class EncryptedIdCacheTest(unittest.TestCase):
+    def tearDown(self):
+        apilib.model.ID_ENCRYPTION_KEY = 'test'
+
+    def test_encode_and_decode_are_cached(self):
+        codec = apilib.get_id_codec()
+        codec.encode_cache.clear()
+        codec.decode_cache.clear()
+        field = apilib.EncryptedId()
+        self.assertEqual('PYW33gW8', field.to_json(123))
+        self.assertEqual('PYW33gW8', field.to_json(123))
+        self.assertEqual(1, codec.encode_cache.hits)
+        self.assertEqual(1, codec.encode_cache.misses)
+
+        for _ in range(2):
+            self.assertEqual(123, field.from_json('PYW33gW8', apilib.ErrorContext()))
+        self.assertEqual(1, codec.decode_cache.hits)
+        self.assertEqual(1, codec.decode_cache.misses)
+
+    def test_invalid_ids_are_not_cached(self):
+        codec = apilib.get_id_codec()
+        codec.decode_cache.clear()
+        for _ in range(2):
+            ec = apilib.ErrorContext()
+            self.assertIsNone(apilib.EncryptedId().from_json('bogus', ec))
+            self.assertEqual(['INVALID_VALUE'], [e.code for e in ec.all_errors()])
+        self.assertEqual(0, len(codec.decode_cache))
+
+    def test_changing_key_replaces_cache(self):
+        field = apilib.EncryptedId()
+        codec = apilib.get_id_codec()
+        self.assertEqual('PYW33gW8', field.to_json(123))
+
+        apilib.model.ID_ENCRYPTION_KEY = 'other'
+        encoded = field.to_json(123)
+        self.assertNotEqual('PYW33gW8', encoded)
+        self.assertIsNot(codec, apilib.get_id_codec())
+        self.assertIs(apilib.get_id_codec().hasher, apilib.model.ID_HASHER)
+        self.assertEqual(123, field.from_json(encoded, apilib.ErrorContext()))
+        self.assertIsNone(field.from_json('PYW33gW8', apilib.ErrorContext()))
+
+class ModelWithIdList(apilib.Model):
+    ids = apilib.Field(apilib.ListType(apilib.EncryptedId()))
+
+class EncryptionSchemeTest(unittest.TestCase):
+    def tearDown(self):
+        apilib.model.ID_ENCRYPTION_SCHEME = 'hashids'
+        apilib.model.ID_DECRYPTION_FALLBACK_SCHEME = None
+
+    def test_feistel_scheme(self):
+        apilib.model.ID_ENCRYPTION_SCHEME = 'feistel'
+        m = ModelWithExtendedFields(fid=123)
+        encoded = m.to_json()['fid']
+        self.assertEqual(apilib.FeistelIdCipher('test').encode(123), encoded)
+        self.assertEqual(123, ModelWithExtendedFields.from_json({'fid': encoded}).fid)
+        self.assertEqual({'ids': [encoded]}, ModelWithIdList(ids=[123]).to_json())
+
+    def test_other_scheme_rejected(self):
+        feistel_id = apilib.FeistelIdCipher('test').encode(123)
+        with self.assertRaises(apilib.DeserializationError):
+            ModelWithExtendedFields.from_json({'fid': feistel_id})
+
+        apilib.model.ID_ENCRYPTION_SCHEME = 'feistel'
+        with self.assertRaises(apilib.DeserializationError):
+            ModelWithIdList.from_json({'ids': [feistel_id, 'PYW33gW8']})
+
+    def test_fallback_scheme(self):
+        feistel_id = apilib.FeistelIdCipher('test').encode(123)
+        apilib.model.ID_DECRYPTION_FALLBACK_SCHEME = 'feistel'
+        self.assertEqual(123, ModelWithExtendedFields.from_json({'fid': feistel_id}).fid)
+        self.assertEqual([123, 123], ModelWithIdList.from_json({'ids': ['PYW33gW8', feistel_id]}).ids)
+
+        apilib.model.ID_ENCRYPTION_SCHEME = 'feistel'
+        apilib.model.ID_DECRYPTION_FALLBACK_SCHEME = 'hashids'
+        self.assertEqual(123, ModelWithExtendedFields.from_json({'fid': 'PYW33gW8'}).fid)
+        self.assertEqual([123, 123], ModelWithIdList.from_json({'ids': ['PYW33gW8', feistel_id]}).ids)
+        self.assertEqual(feistel_id, ModelWithExtendedFields(fid=123).to_json()['fid'])
+
+        with mock.patch.object(apilib.FeistelIdCipher, 'decode', return_value=5):
+            # The configured scheme's reading wins
+            apilib.model._id_codec = None
+            self.assertEqual(5, ModelWithExtendedFields.from_json({'fid': 'PYW33gW8'}).fid)
+        apilib.model._id_codec = None
+
+        apilib.model.ID_DECRYPTION_FALLBACK_SCHEME = 'rot13'
+        self.assertRaises(apilib.exceptions.ConfigurationRequired, apilib.get_id_codec)
+
+    def test_unknown_scheme(self):
+        apilib.model.ID_ENCRYPTION_SCHEME = 'rot13'
+        self.assertRaises(apilib.exceptions.ConfigurationRequired, apilib.get_id_codec)
+
+class BatchedListItemsTest(unittest.TestCase):
+    def test_id_list_round_trip(self):
+        ids = [123, 5, 123, 70000]
+        encoded = [apilib.EncryptedId().to_json(i) for i in ids]
+        m = ModelWithIdList(ids=ids)
+        self.assertEqual({'ids': encoded}, m.to_json())
+        self.assertEqual({'ids': encoded}, json.loads(m.to_json_bytes()))
+        self.assertEqual({'ids': encoded}, json.loads(''.join(m.iter_json())))
+        self.assertEqual(ids, ModelWithIdList.from_json({'ids': encoded}).ids)
+
+    def test_id_list_with_none(self):
+        m = ModelWithIdList(ids=[123, None])
+        self.assertEqual({'ids': ['PYW33gW8', None]}, m.to_json())
+        self.assertEqual([123, None], ModelWithIdList.from_json({'ids': ['PYW33gW8', None]}).ids)
+
+    def test_id_list_errors(self):
+        ec = apilib.ErrorContext()
+        self.assertIsNone(ModelWithIdList.from_json({'ids': ['PYW33gW8', 'bogus', 'PYW33gW8', 'bogus']}, ec))
+        self.assertEqual(
+            [('INVALID_VALUE', 'ids[1]'), ('INVALID_VALUE', 'ids[3]')],
+            [(e.code, e.path) for e in ec.all_errors()])
+
+        ec = apilib.ErrorContext()
+        self.assertIsNone(ModelWithIdList.from_json({'ids': ['PYW33gW8', 5]}, ec))
+        self.assertEqual([('INVALID_TYPE', 'ids[1]')], [(e.code, e.path) for e in ec.all_errors()])
+
+    def test_custom_batching_type(self):
+        class BatchedString(apilib.String):
+            batches = []
+
+            def to_json_many(self, values):
+                self.batches.append(list(values))
+                return [v.upper() for v in values]
+
+            def from_json_many(self, values, error_context, context=None):
+                self.batches.append(list(values))
+                return [v.lower() for v in values]
+
+        class ModelWithBatchedStrings(apilib.Model):
+            values = apilib.Field(apilib.ListType(BatchedString()))
+
+        m = ModelWithBatchedStrings(values=['a', 'b'])
+        self.assertEqual({'values': ['A', 'B']}, m.to_json())
+        self.assertEqual(b'{"values": ["A", "B"]}', m.to_json_bytes())
+        self.assertEqual(['a', 'b'], ModelWithBatchedStrings.from_json({'values': ['A', 'B']}).values)
+        self.assertEqual([['a', 'b'], ['a', 'b'], ['A', 'B']], BatchedString.batches)
+
 class NGrandchild(apilib.Model):
     fint = apilib.Field(apilib.Integer())
     lfloat = apilib.Field(apilib.ListType(apilib.Float()))
@@ -697,6 +891,43 @@ class ToStringTest(unittest.TestCase):
 }>'''[1:]
         self.assertEqual(expected, str(m))
 
+    def test_iter_string(self):
+        class CustomChild(BasicScalarModel):
+            def to_string(self, indent=''):
+                return '<custom>'
+
+        m = ToStringModel(
+            fint=1,
+            fchild=CustomChild(fint=2),
+            lchild=[BasicScalarModel(fstring='a'), None, CustomChild()],
+            dchild={'foo': BasicScalarModel(fbool=True)})
+        self.assertEqual(m.to_string(), ''.join(m.iter_string()))
+        self.assertEqual(m.to_string('  '), ''.join(m.iter_string('  ')))
+        self.assertIn('fchild: <custom>,', m.to_string())
+        self.assertEqual('<custom>', ''.join(CustomChild().iter_string()))
+
+
+class ToStringItemLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.max_items = apilib.model.TO_STRING_MAX_ITEMS
+        apilib.model.TO_STRING_MAX_ITEMS = 2
+
+    def tearDown(self):
+        apilib.model.TO_STRING_MAX_ITEMS = self.max_items
+
+    def test_long_lists_and_dicts_truncated(self):
+        m = ScalarListModel(lint=[1, 2, 3, 4])
+        self.assertEqual('''<ScalarListModel: {
+  lint: [
+    1,
+    2,
+    ... 2 more,
+    ],
+}>''', m.to_string())
+
+        m = ScalarDictModel(dint={'a': 1, 'b': 2, 'c': 3})
+        self.assertIn('... 1 more,', m.to_string())
+        self.assertNotIn('more', ScalarDictModel(dint={'a': 1, 'b': 2}).to_string())
 
 class InheritanceFieldMappingTest(unittest.TestCase):
     class Base(apilib.Model):
@@ -931,5 +1162,423 @@ class HashAndEqualityTest(unittest.TestCase):
         self.assertIsNotNone(hash(m))
         self.assertEqual(hash(m), hash(m2))
 
+    def test_same_as_comparing_to_dict(self):
+        self.assertNotEqual(BasicScalarModel(fint=None), BasicScalarModel())
+        self.assertNotEqual(BasicScalarModel(fint=1), BasicScalarModel(fint=2))
+        self.assertNotEqual(NGrandchild(lfloat=[1.0]), NGrandchild(lfloat=[1.0, 2.0]))
+        self.assertNotEqual(NParent(lchild=[NChild(fstring='a')]), NParent(lchild=[NChild(fstring='b')]))
+
+        # Decimals are compared by their serialized form
+        self.assertNotEqual(
+            ModelWithExtendedFields(fdecimal=decimal.Decimal('1.0')),
+            ModelWithExtendedFields(fdecimal=decimal.Decimal('1.00')))
+        m = ModelWithExtendedFields(fdecimal=decimal.Decimal('1.0'), fid=5)
+        m2 = ModelWithExtendedFields(fdecimal=decimal.Decimal('1.0'), fid=5)
+        self.assertEqual(m, m2)
+        self.assertEqual(hash(m), hash(m2))
+
+        m = ScalarDictModel(dstring={'a': 'x', 'b': 'y'})
+        m2 = ScalarDictModel(dstring={'b': 'y', 'a': 'x'})
+        self.assertEqual(m, m2)
+        self.assertEqual(hash(m), hash(m2))
+        self.assertNotEqual(m, ScalarDictModel(dstring={'a': 'x', 'c': 'y'}))
+
+        m = ModelWithCustomSerialization(freversed='abc', lreversed=['de'])
+        self.assertEqual(m, ModelWithCustomSerialization(freversed='abc', lreversed=['de']))
+        self.assertNotEqual(m, ModelWithCustomSerialization(freversed='abc', lreversed=['ed']))
+
+        nan = float('nan')
+        m = NGrandchild(lfloat=[nan])
+        self.assertEqual(m, m)
+
+    def test_deduplication(self):
+        models = [NChild(fgrandchild=NGrandchild(fint=i % 3), fstring=str(i % 2)) for i in range(12)]
+        self.assertEqual(6, len(set(models)))
+
+    def test_cached_fingerprint(self):
+        m = CachedModel(fint=1)
+        h = hash(m)
+        self.assertEqual(h, hash(m))
+        with mock.patch.object(CachedModel, '_get_equality_plan') as get_plan:
+            self.assertEqual(h, hash(m))
+            self.assertFalse(get_plan.called)
+
+        m.fint = 2
+        self.assertEqual(hash(CachedModel(fint=2)), hash(m))
+        self.assertEqual(hash(m), hash(CachedModel.from_json({'fint': 2})))
+
+    def test_cached_fingerprint_not_pickled(self):
+        for m in (CachedModel(fint=1), CachedCompactModel(fint=1)):
+            hash(m)
+            self.assertIsNotNone(m._fingerprint)
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                m2 = pickle.loads(pickle.dumps(m, protocol))
+                self.assertIsNone(getattr(m2, '_fingerprint', None))
+                self.assertEqual(m, m2)
+                self.assertEqual(hash(type(m)(fint=1)), hash(m2))
+
+    def test_compact_models(self):
+        m = CompactParent(fchild=CompactChild(fint=1), lchild=[CompactChild(fstring='a')])
+        m2 = CompactParent(fchild=CompactChild(fint=1), lchild=[CompactChild(fstring='a')])
+        self.assertEqual(m, m2)
+        self.assertEqual(hash(m), hash(m2))
+        m2.fchild.fint = 2
+        self.assertNotEqual(m, m2)
+
+        m = CachedCompactModel(fint=1)
+        h = hash(m)
+        m.fint = 2
+        self.assertNotEqual(h, hash(m))
+        self.assertEqual(hash(CachedCompactModel(fint=2)), hash(m))
+
+class UppercaseString(apilib.String):
+    def normalize(self, value):
+        return value.upper() if value is not None else None
+
+class ModelWithCustomFieldType(apilib.Model):
+    fupper = apilib.Field(UppercaseString())
+    fstring = apilib.Field(apilib.String())
+
+class ModelWithCustomInit(apilib.Model):
+    fstring = apilib.Field(apilib.String())
+
+    def __init__(self, **kwargs):
+        super(ModelWithCustomInit, self).__init__(**kwargs)
+        self.initialized = True
+
+class DeserializationPlanTest(unittest.TestCase):
+    def test_plan_cached_per_class(self):
+        BasicChildModel.from_json({'fstring': 'a'})
+        plan = BasicChildModel.__dict__['_from_json_plan']
+        BasicChildModel.from_json({'fstring': 'b'})
+        self.assertIs(plan, BasicChildModel.__dict__['_from_json_plan'])
+
+        InheritanceFieldMappingTest.Subclass.from_json({'base': 'a', 'subclass': 'b'})
+        self.assertIsNot(
+            InheritanceFieldMappingTest.Base.__dict__.get('_from_json_plan'),
+            InheritanceFieldMappingTest.Subclass.__dict__['_from_json_plan'])
+
+    def test_custom_field_type_is_normalized(self):
+        m = ModelWithCustomFieldType.from_json({'fupper': 'abc', 'fstring': 'def'})
+        self.assertEqual('ABC', m.fupper)
+        self.assertEqual('def', m.fstring)
+        self.assertEqual({'fupper': u'ABC', 'fstring': u'def'}, m.to_json())
+
+    def test_fields_parsed_in_order(self):
+        class PositiveInteger(apilib.Integer):
+            def from_json(self, value, error_context, context=None):
+                if value <= 0:
+                    error_context.add_error('INVALID_VALUE', 'Must be positive')
+                    return None
+                return value
+
+        class Model(apilib.Model):
+            a_custom = apilib.Field(PositiveInteger())
+            b_int = apilib.Field(apilib.Integer())
+            c_custom = apilib.Field(PositiveInteger())
+
+        obj = {'a_custom': 0, 'b_int': 'x', 'c_custom': -1}
+        with self.assertRaises(apilib.DeserializationError) as e:
+            Model.from_json(obj)
+        self.assertEqual(['a_custom', 'b_int', 'c_custom'], [error.path for error in e.exception.errors])
+        with self.assertRaises(apilib.DeserializationError) as e:
+            Model.from_json(obj, max_errors=1)
+        self.assertEqual(['a_custom'], [error.path for error in e.exception.errors])
+
+    def test_custom_init_is_called(self):
+        m = ModelWithCustomInit.from_json({'fstring': 'abc'})
+        self.assertTrue(m.initialized)
+        self.assertEqual('abc', m.fstring)
+
+    def test_deserialized_lists_are_copies(self):
+        obj = {'lstring': [u'a', u'b'], 'lint': [1, None]}
+        m = ScalarListModel.from_json(obj)
+        obj['lstring'].append(u'c')
+        self.assertEqual(['a', 'b'], m.lstring)
+        self.assertEqual([1, None], m.lint)
+
+    def test_all_fields_set(self):
+        m = BasicScalarModel.from_json({'fint': 1})
+        self.assertEqual({'fstring': None, 'fint': 1, 'ffloat': None, 'fbool': None}, m.to_json())
+
+class CustomToJsonChild(apilib.Model):
+    fstring = apilib.Field(apilib.String())
+
+    def to_json(self):
+        return {'custom': self.fstring}
+
+class CustomToJsonParent(apilib.Model):
+    fchild = apilib.Field(apilib.ModelType(CustomToJsonChild))
+    lchild = apilib.Field(apilib.ListType(CustomToJsonChild))
+
+class ReversedString(apilib.String):
+    def to_json(self, value):
+        return value[::-1] if value is not None else u'<none>'
+
+class ModelWithCustomSerialization(apilib.Model):
+    freversed = apilib.Field(ReversedString())
+    lreversed = apilib.Field(apilib.ListType(ReversedString()))
+
+class SerializationPlanTest(unittest.TestCase):
+    def test_nested_to_json_override_respected(self):
+        m = CustomToJsonParent(fchild=CustomToJsonChild(fstring='a'), lchild=[CustomToJsonChild(fstring='b'), None])
+        self.assertEqual({'fchild': {'custom': 'a'}, 'lchild': [{'custom': 'b'}, None]}, m.to_json())
+
+    def test_custom_field_type_serialization(self):
+        m = ModelWithCustomSerialization(freversed='abc', lreversed=['de', None])
+        self.assertEqual({'freversed': 'cba', 'lreversed': ['ed', u'<none>']}, m.to_json())
+
+        m = ModelWithCustomSerialization(freversed=None)
+        self.assertEqual({'freversed': u'<none>'}, m.to_json())
+
+    def test_values_converted(self):
+        m = BasicScalarModel(fint=True, ffloat=3, fbool=0)
+        d = m.to_json()
+        self.assertEqual({'fint': 1, 'ffloat': 3.0, 'fbool': False}, d)
+        self.assertEqual(int, type(d['fint']))
+        self.assertEqual(float, type(d['ffloat']))
+        self.assertEqual(bool, type(d['fbool']))
+
+    def test_containers_copied(self):
+        m = ArbitraryPrimitivesModel(lany=[1, 2], dany={'a': 1})
+        d = m.to_json()
+        d['lany'].append(3)
+        d['dany']['b'] = 2
+        self.assertEqual([1, 2], m.lany)
+        self.assertEqual({'a': 1}, m.dany)
+
+class FieldPopulationTest(unittest.TestCase):
+    def test_lock_not_taken_once_populated(self):
+        BasicScalarModel.init()
+        field_lock = apilib.model._field_lock
+        apilib.model._field_lock = None
+        try:
+            m = BasicScalarModel(fint=1)
+            self.assertEqual(1, BasicScalarModel.from_json({'fint': 1}).fint)
+            self.assertEqual(4, len(BasicScalarModel.get_fields()))
+        finally:
+            apilib.model._field_lock = field_lock
+
+    def test_concurrent_population(self):
+        class ConcurrentModel(apilib.Model):
+            fstring = apilib.Field(apilib.String())
+            fint = apilib.Field(apilib.Integer())
+
+        results = []
+        def instantiate():
+            results.append(ConcurrentModel.from_json({'fstring': 'a', 'fint': 1}).to_json())
+        threads = [threading.Thread(target=instantiate) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([{'fstring': u'a', 'fint': 1}] * 10, results)
+        self.assertEqual(['fint', 'fstring'], sorted(ConcurrentModel.get_field_names()))
+
+class CachedModel(apilib.Model):
+    cache_fingerprint = True
+    fint = apilib.Field(apilib.Integer())
+
+class CachedCompactModel(apilib.CompactModel):
+    __slots__ = ()
+    cache_fingerprint = True
+    fint = apilib.Field(apilib.Integer())
+
+class CompactChild(apilib.CompactModel):
+    fstring = apilib.Field(apilib.String())
+    fint = apilib.Field(apilib.Integer())
+
+class CompactParent(apilib.CompactModel):
+    fchild = apilib.Field(apilib.ModelType(CompactChild))
+    lchild = apilib.Field(apilib.ListType(CompactChild))
+    fdate = apilib.Field(apilib.Date())
+
+class CompactSubclass(CompactChild):
+    __slots__ = ()
+
+    fint = apilib.Field(apilib.Integer(), required=True)
+    ffloat = apilib.Field(apilib.Float())
+
+class CompactFooResponse(apilib.CompactResponse):
+    __slots__ = ()
+
+    fstring = apilib.Field(apilib.String())
+
+class CompactChildLike(apilib.Model):
+    fstring = apilib.Field(apilib.String())
+    fint = apilib.Field(apilib.Integer())
+
+class CompactModelTest(unittest.TestCase):
+    def test_no_instance_dict(self):
+        for m in (CompactChild(), CompactParent(), CompactSubclass(), CompactFooResponse()):
+            self.assertFalse(hasattr(m, '__dict__'))
+        with self.assertRaises(AttributeError):
+            CompactChild().unknown = 1
+
+    def test_field_access(self):
+        m = CompactChild(fstring='a')
+        self.assertEqual('a', m.fstring)
+        self.assertIsNone(m.fint)
+        m.fint = 5
+        self.assertEqual(5, m.fint)
+        self.assertEqual({'fstring': 'a', 'fint': 5}, m.to_dict())
+        self.assertIsInstance(CompactChild.fstring, apilib.Field)
+        self.assertEqual(['fint', 'fstring'], sorted(CompactChild.get_field_names()))
+
+    def test_to_dict_only_includes_set_fields(self):
+        self.assertEqual({'fstring': 'a'}, CompactChild(fstring='a').to_dict())
+        self.assertEqual({'fstring': 'a', 'fint': None}, CompactChild(fstring='a', fint=None).to_dict())
+        m = CompactParent(fchild=CompactChild(fint=1), lchild=[CompactChild(fstring='b')], fdate=datetime.date(2020, 1, 2))
+        self.assertEqual({'fchild': {'fint': 1}, 'lchild': [{'fstring': 'b'}], 'fdate': '2020-01-02'}, m.to_dict())
+
+    def test_from_json(self):
+        obj = {'fchild': {'fstring': 'a', 'fint': 1}, 'lchild': [{'fint': 2}], 'fdate': '2020-01-02'}
+        m = CompactParent.from_json(obj)
+        self.assertEqual('a', m.fchild.fstring)
+        self.assertEqual(2, m.lchild[0].fint)
+        self.assertIsNone(m.lchild[0].fstring)
+        self.assertEqual(datetime.date(2020, 1, 2), m.fdate)
+        self.assertEqual(CompactParent(
+            fchild=CompactChild(fstring='a', fint=1),
+            lchild=[CompactChild(fstring=None, fint=2)],
+            fdate=datetime.date(2020, 1, 2)), m)
+
+    def test_pickle(self):
+        for m in (CompactChild(fstring='a'), CompactParent(fchild=CompactChild(fint=1), lchild=[]), CompactFooResponse(response_code='SUCCESS')):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                m2 = pickle.loads(pickle.dumps(m, protocol))
+                self.assertEqual(m, m2)
+                self.assertEqual(m.to_dict(), m2.to_dict())
+
+    def test_equality_and_hash(self):
+        self.assertEqual(CompactChild(fstring='a'), CompactChild(fstring='a'))
+        self.assertEqual(hash(CompactChild(fstring='a')), hash(CompactChild(fstring='a')))
+        self.assertNotEqual(CompactChild(fstring='a'), CompactChild(fstring='b'))
+        self.assertNotEqual(CompactChild(fstring='a'), CompactSubclass(fstring='a'))
+
+    def test_inheritance(self):
+        m = CompactSubclass(fstring='a', fint=1, ffloat=2)
+        self.assertEqual({'fstring': 'a', 'fint': 1, 'ffloat': 2.0}, m.to_dict())
+        self.assertEqual(('_slot_ffloat',), CompactSubclass.__slots__)
+        with self.assertRaises(apilib.exceptions.DeserializationError):
+            CompactSubclass.from_json({'fstring': 'a'}, context=apilib.ValidationContext())
+
+        m = CompactFooResponse(response_code='SUCCESS', fstring='a')
+        self.assertEqual({'response_code': 'SUCCESS', 'fstring': 'a'}, m.to_dict())
+        self.assertIsInstance(CompactFooResponse.response_code, apilib.Field)
+
+        # Mixing a regular model into a compact one keeps the instance dict
+        class MixedResponse(apilib.Response, apilib.CompactModel):
+            fstring = apilib.Field(apilib.String())
+        m = MixedResponse(response_code='SUCCESS', errors=None, fstring='a')
+        self.assertEqual({'response_code': 'SUCCESS', 'errors': None, 'fstring': 'a'}, m.to_dict())
+        self.assertEqual(m, MixedResponse.from_json(m.to_dict()))
+
+    def test_regular_models_unaffected(self):
+        class ModelException(apilib.Model, Exception):
+            fstring = apilib.Field(apilib.String())
+        self.assertEqual('a', ModelException(fstring='a').fstring)
+
+        for m in (CompactChildLike(fstring='a'), apilib.Response(response_code='SUCCESS')):
+            self.assertTrue(hasattr(m, '__dict__'))
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                self.assertEqual(m, pickle.loads(pickle.dumps(m, protocol)))
+
+    def test_to_string(self):
+        self.assertEqual("<CompactChild: {\n  fint: 1,\n  fstring: 'a',\n}>", str(CompactChild(fstring='a', fint=1)))
+        self.assertEqual(str(CompactChildLike(fstring='a', fint=1)).replace('CompactChildLike', 'CompactChild'),
+            str(CompactChild(fstring='a', fint=1)))
+
+
+class StreamingJsonTest(unittest.TestCase):
+    def assertStreamsLikeToJsonStr(self, m, chunk_size=None):
+        self.assertEqual(m.to_json_str(), ''.join(m.iter_json(chunk_size)))
+
+    def test_matches_to_json_str(self):
+        self.assertStreamsLikeToJsonStr(BasicScalarModel())
+        self.assertStreamsLikeToJsonStr(BasicScalarModel(fstring=u'\u00e9"\n', fint=1, ffloat=1.5, fbool=False))
+        self.assertStreamsLikeToJsonStr(ScalarListModel(lstring=[], lint=[1, None, 3]))
+        self.assertStreamsLikeToJsonStr(ScalarDictModel(dstring={'a': 'b'}, dint={}))
+        self.assertStreamsLikeToJsonStr(ArbitraryPrimitivesModel(fany={'a': [1, 'b']}, lany=[1, 'a', None], dany={}))
+        self.assertStreamsLikeToJsonStr(ModelWithExtendedFields(fdecimal=decimal.Decimal('1.5'), fenum='Jerry', fid=5))
+        self.assertStreamsLikeToJsonStr(ModelWithDates(fdate=datetime.date(2020, 1, 2)))
+
+    def test_nested_models(self):
+        self.assertStreamsLikeToJsonStr(NParent(
+            fchild=NChild(fgrandchild=NGrandchild(fint=1, lfloat=[1.0, 2.5]), lgrandchild=[]),
+            lchild=[NChild(fstring='a', lgrandchild=[NGrandchild(fint=2), None]), None]))
+        self.assertStreamsLikeToJsonStr(DeeplyNested(fdeep={'a': [BasicScalarModel(fstring='blah')], 'b': [], 'c': None}))
+        self.assertStreamsLikeToJsonStr(CompactParent(fchild=CompactChild(fint=1), lchild=[CompactChild(fstring='b')]))
+
+    def test_values_left_to_the_json_library(self):
+        for m in (ModelWithBytes(fbytes=b'abc'),
+                ArbitraryPrimitivesModel(fany=decimal.Decimal('1.5'), lany=[datetime.date(2020, 1, 2)], dany={'a': b'x'})):
+            self.assertStreamsLikeToJsonStr(m)
+            self.assertEqual(m.to_json_str().encode('utf-8'), m.to_json_bytes())
+
+    def test_non_string_dict_keys(self):
+        class ModelDict(apilib.Model):
+            d = apilib.Field(apilib.DictType(NChild))
+        m = ModelDict(d={1: NChild(fstring='a'), 1.5: NChild(), False: None, None: NChild(), u'\u00e9': NChild()})
+        self.assertStreamsLikeToJsonStr(m)
+        self.assertEqual(['1', '1.5', 'false', 'null', u'\u00e9'], sorted(json.loads(''.join(m.iter_json()))['d']))
+
+    def test_custom_serialization_respected(self):
+        self.assertStreamsLikeToJsonStr(CustomToJsonParent(fchild=CustomToJsonChild(fstring='a'), lchild=[CustomToJsonChild()]))
+        self.assertStreamsLikeToJsonStr(ModelWithCustomSerialization(freversed='abc', lreversed=['de', None]))
+
+    def test_chunking(self):
+        m = NParent(lchild=[NChild(fstring=str(i), lgrandchild=[NGrandchild(lfloat=[1.0] * 100)]) for i in range(50)])
+        chunks = list(m.iter_json(1024))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(chunk) < 2 * 1024 for chunk in chunks))
+        self.assertEqual(m.to_json_str(), ''.join(chunks))
+        self.assertEqual([m.to_json_str()], list(m.iter_json(10 ** 9)))
+
+    def test_write_json(self):
+        m = BasicScalarModel(fstring='a', fint=1)
+        fp = six.StringIO()
+        m.write_json(fp)
+        self.assertEqual(m.to_json_str(), fp.getvalue())
+
+
+class JsonBytesTest(unittest.TestCase):
+    def assertEncodesLikeJsonDumps(self, m):
+        self.assertEqual(json.dumps(m.to_json()).encode('utf-8'), m.to_json_bytes())
+
+    def test_scalars(self):
+        self.assertEncodesLikeJsonDumps(BasicScalarModel())
+        self.assertEncodesLikeJsonDumps(BasicScalarModel(fstring=None, fint=None))
+        self.assertEncodesLikeJsonDumps(BasicScalarModel(fstring=u'\u00e9"\n\u2028', fint=-12, ffloat=0.1, fbool=False))
+        self.assertEncodesLikeJsonDumps(BasicScalarModel(fint=True, ffloat=3, fbool=1))
+        for value in (float('nan'), float('inf'), -float('inf'), 1e100, -0.0):
+            self.assertEncodesLikeJsonDumps(BasicScalarModel(ffloat=value))
+
+    def test_extended_types(self):
+        self.assertEncodesLikeJsonDumps(ModelWithExtendedFields(fdecimal=decimal.Decimal('1.50'), fenum='George', fid=12))
+        self.assertEncodesLikeJsonDumps(ModelWithDates(
+            fdate=datetime.date(2020, 1, 2), fdatetime=datetime.datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=tz.tzutc())))
+        self.assertEncodesLikeJsonDumps(ModelWithDateList(ldate=[datetime.date(2020, 1, 2), None], ldatetime=[]))
+        self.assertEncodesLikeJsonDumps(ArbitraryPrimitivesModel(fany={'a': [1, 'b', None]}, lany=[1.5, True], dany={'x': {}}))
+
+    def test_containers(self):
+        self.assertEncodesLikeJsonDumps(ScalarListModel(lstring=['a', None], lint=[], lfloat=(1.0, 2)))
+        self.assertEncodesLikeJsonDumps(ScalarDictModel(dstring={'a': 'b', 'c': None}, dint={1: 2}, dbool={}))
+        self.assertEncodesLikeJsonDumps(DeeplyNested(fdeep={'a': [BasicScalarModel(fstring='blah'), None], 'b': None}))
+        self.assertEncodesLikeJsonDumps(NParent(
+            fchild=NChild(fgrandchild=NGrandchild(fint=1, lfloat=[1.0, 2.5])),
+            lchild=[NChild(fstring='a', lgrandchild=[NGrandchild(fint=2), None]), None]))
+
+    def test_custom_serialization_respected(self):
+        self.assertEncodesLikeJsonDumps(CustomToJsonChild(fstring='a'))
+        self.assertEncodesLikeJsonDumps(CustomToJsonParent(fchild=CustomToJsonChild(fstring='a'), lchild=[CustomToJsonChild()]))
+        self.assertEncodesLikeJsonDumps(ModelWithCustomSerialization(freversed='abc', lreversed=['de', None]))
+        self.assertEncodesLikeJsonDumps(ModelWithCustomFieldType(fupper='abc'))
+
+    def test_compact_models(self):
+        self.assertEncodesLikeJsonDumps(CompactParent(fchild=CompactChild(fint=1), lchild=[CompactChild(fstring='b')]))
+        self.assertEncodesLikeJsonDumps(CompactChild())
+
+
 if __name__ == '__main__':
     unittest.main()
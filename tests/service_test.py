@@ -1,11 +1,15 @@
 from __future__ import absolute_import
 
+from io import BytesIO
 from io import StringIO
 import json
+import logging
+import threading
 import unittest
 
 import mock
 import requests
+from six.moves import BaseHTTPServer
 
 import apilib
 
@@ -65,6 +69,165 @@ class BasicServiceTest(unittest.TestCase):
         self.assertIsNotNone(response)
         self.assertEqual({'response_str': u'Your request string was: blah', 'response_code': u'SUCCESS'}, response)
 
+    def test_streaming_response(self):
+        service = FooServiceImpl()
+        chunks = list(service.invoke_with_json_iter('foo', {'request_str': 'blah'}))
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+        self.assertEqual({'response_str': u'Your request string was: blah', 'response_code': u'SUCCESS'},
+            json.loads(b''.join(chunks).decode('utf-8')))
+
+        chunks = list(service.invoke_with_json_iter('foo', {'request_str': None}))
+        self.assertEqual('REQUEST_ERROR', json.loads(b''.join(chunks).decode('utf-8'))['response_code'])
+
+class BulkFooRequest(apilib.Request):
+    requests = apilib.Field(apilib.ListType(FooRequest))
+
+class BulkFooService(apilib.Service):
+    methods = apilib.servicemethods(
+        apilib.Meth('foo', BulkFooRequest, FooResponse))
+
+class BulkFooServiceImpl(BulkFooService, apilib.ServiceImplementation):
+    max_request_errors = 5
+
+    def foo(self, request):
+        return FooResponse(response_str='%d requests' % len(request.requests))
+
+class ErrorLimitServiceTest(unittest.TestCase):
+    def test_errors_capped(self):
+        service = BulkFooServiceImpl()
+        response = service.invoke_with_json('foo', {'requests': [{'request_str': 1}] * 100})
+        self.assertEqual('REQUEST_ERROR', response['response_code'])
+        self.assertEqual(5, len(response['errors']))
+        self.assertEqual('requests[4].request_str', response['errors'][4]['path'])
+
+        response = service.invoke_with_json('foo', {'requests': [{'request_str': 'a'}] * 100})
+        self.assertEqual('SUCCESS', response['response_code'])
+
+class FailingBulkFooServiceImpl(BulkFooService, apilib.ServiceImplementation):
+    max_log_length = 100
+
+    def foo(self, request):
+        raise ValueError('Failed')
+
+    def process_unhandled_exception(self, exception):
+        return False
+
+class LoggingTest(unittest.TestCase):
+    @mock.patch('apilib.service.logger')
+    def test_server_error_logged_truncated(self, mock_logger):
+        mock_logger.isEnabledFor.return_value = True
+        service = FailingBulkFooServiceImpl()
+        response = service.invoke_with_json('foo', {'requests': [{'request_str': 'a'}] * 100})
+        self.assertEqual('SERVER_ERROR', response['response_code'])
+
+        args = mock_logger.error.call_args[0]
+        message = args[0] % args[1:]
+        self.assertIn('FailingBulkFooServiceImpl.foo', message)
+        self.assertIn('{"requests": [{"request_str": "a"}, ', message)
+        self.assertIn('... (truncated)', message)
+        self.assertIn('{"response_code": "SERVER_ERROR"}', message)
+        self.assertLess(len(message), 1000)
+
+    @mock.patch('apilib.service.logger')
+    def test_nothing_formatted_when_disabled(self, mock_logger):
+        mock_logger.isEnabledFor.return_value = False
+        with mock.patch.object(BulkFooRequest, 'to_string') as to_string:
+            response = BulkFooServiceImpl().invoke_with_json('foo', {'requests': [{'request_str': 'a'}]})
+            self.assertEqual('SUCCESS', response['response_code'])
+            self.assertFalse(to_string.called)
+        self.assertFalse(mock_logger.debug.called)
+
+    @mock.patch('apilib.service.logger')
+    def test_debug_rendering_stops_at_max_log_length(self, mock_logger):
+        mock_logger.isEnabledFor.return_value = True
+        with mock.patch('apilib.model._iter_model_string', wraps=apilib.model._iter_model_string) as iter_model_string:
+            response = FailingBulkFooServiceImpl().invoke_with_json('foo', {'requests': [{'request_str': 'a'}] * 100})
+            self.assertEqual('SERVER_ERROR', response['response_code'])
+            args = mock_logger.debug.call_args_list[0][0]
+            message = args[0] % args[1:]
+        self.assertIn('BulkFooRequest', message)
+        self.assertIn('... (truncated)', message)
+        self.assertLess(iter_model_string.call_count, 10)
+
+class StreamingBulkFooServiceImpl(BulkFooService, apilib.ServiceImplementation):
+    def foo(self, request):
+        count = sum(1 for _ in request.requests)
+        return FooResponse(response_str='%d requests' % count)
+
+class RaisingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+    def handleError(self, record):
+        raise
+
+class StreamingRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = RaisingHandler()
+        self.logger = logging.getLogger('apilib.service')
+        self.level = self.logger.level
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+
+    def test_streamed_request_logged(self):
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.DEBUG)
+        body = json.dumps({'requests': [{'request_str': 'a'}] * 10})
+        response = StreamingBulkFooServiceImpl().invoke_with_json_stream('foo', body, iter_field='requests')
+        self.assertEqual({'response_code': 'SUCCESS', 'response_str': '10 requests'}, response)
+        self.assertIn('requests: <streamed>', self.handler.messages[0])
+
+        class FailingStreamingService(StreamingBulkFooServiceImpl):
+            def foo(self, request):
+                self.consumed = next(request.requests)
+                raise ValueError('Crashed')
+
+            def process_unhandled_exception(self, exception):
+                return False
+        service = FailingStreamingService()
+        response = service.invoke_with_json_stream('foo', body, iter_field='requests')
+        self.assertEqual('SERVER_ERROR', response['response_code'])
+        self.assertEqual('a', service.consumed.request_str)
+        self.assertIn('{"requests": "<streamed>"}', self.handler.messages[-1])
+
+    def test_streamed_request(self):
+        service = StreamingBulkFooServiceImpl()
+        body = json.dumps({'requests': [{'request_str': 'a'}] * 100}).encode('utf-8')
+        response = service.invoke_with_json_stream('foo', BytesIO(body), iter_field='requests')
+        self.assertEqual({'response_code': 'SUCCESS', 'response_str': '100 requests'}, response)
+
+    def test_invalid_streamed_item(self):
+        service = StreamingBulkFooServiceImpl()
+        body = json.dumps({'requests': [{'request_str': 'a'}, {'request_str': None}]})
+        response = service.invoke_with_json_stream('foo', body, iter_field='requests')
+        self.assertEqual('REQUEST_ERROR', response['response_code'])
+        self.assertEqual(['requests[1].request_str'], [e['path'] for e in response['errors']])
+
+    def test_request_errors_before_method_called(self):
+        service = StreamingBulkFooServiceImpl()
+        response = service.invoke_with_json_stream('foo', '{"unknown": 1, "requests": []}', iter_field='requests')
+        self.assertEqual('REQUEST_ERROR', response['response_code'])
+        self.assertEqual(['unknown'], [e['path'] for e in response['errors']])
+
+        response = BulkFooServiceImpl().invoke_with_json_stream('foo', '{"requests": [{"request_str": 1}]}')
+        self.assertEqual(['requests[0].request_str'], [e['path'] for e in response['errors']])
+
+    def test_malformed_json(self):
+        for body in ('{"requests": [{"request_str": "a"}', '{"requests": []} x', b'{"requests": "\xc3"}'):
+            response = BulkFooServiceImpl().invoke_with_json_stream('foo', body)
+            self.assertEqual('REQUEST_ERROR', response['response_code'])
+            self.assertEqual(['INVALID_VALUE'], [e['code'] for e in response['errors']])
+
+        response = StreamingBulkFooServiceImpl().invoke_with_json_stream('foo', '{"requests": [{"request_str": "a"}, x', iter_field='requests')
+        self.assertEqual('REQUEST_ERROR', response['response_code'])
+        self.assertEqual(['requests'], [e['path'] for e in response['errors']])
+
 class MockJsonResponse(object):
     def __init__(self, status_code, json_data, text=None):
         self.status_code = status_code
@@ -75,7 +238,7 @@ class MockJsonResponse(object):
         return self.json_data
 
 class RemoteServiceTest(unittest.TestCase):
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_remote_request(self, mock_post):
         service = RemoteFooService('http://localhost:5000')
         mock_post.return_value = MockJsonResponse(200, {'response_str': 'this is a response', 'response_code': 'SUCCESS'})
@@ -89,7 +252,7 @@ class RemoteServiceTest(unittest.TestCase):
         self.assertEqual('{"request_str": "blah"}', mock_post.call_args[1]['data'])
         self.assertEqual({'Content-Type': 'application/json'}, mock_post.call_args[1]['headers'])
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_trailing_slashes_removed_from_urls(self, mock_post):
         class AltRemoteFooService(RemoteFooService):
             path = '/foo_service/'
@@ -105,6 +268,73 @@ class RemoteServiceTest(unittest.TestCase):
         self.assertEqual('{"request_str": "blah"}', mock_post.call_args[1]['data'])
         self.assertEqual({'Content-Type': 'application/json'}, mock_post.call_args[1]['headers'])
 
+    @unittest.skipIf(apilib.jsonbackend.orjson is None, 'orjson is not installed')
+    @mock.patch('requests.Session.post')
+    def test_json_backend(self, mock_post):
+        class OrjsonRemoteFooService(RemoteFooService):
+            json_backend = 'orjson'
+        service = OrjsonRemoteFooService('http://localhost:5000')
+        mock_post.return_value = MockJsonResponse(200, None)
+        mock_post.return_value.content = b'{"response_str":"this is a response","response_code":"SUCCESS"}'
+        foo_response = service.foo(FooRequest(request_str='blah'))
+        self.assertEqual('this is a response', foo_response.response_str)
+        self.assertEqual('{"request_str":"blah"}', mock_post.call_args[1]['data'])
+
+    @mock.patch('requests.Session.post')
+    def test_default_transport_shared(self, mock_post):
+        mock_post.return_value = MockJsonResponse(200, {'response_code': 'SUCCESS'})
+        RemoteFooService('http://localhost:5000').foo(FooRequest(request_str='blah'))
+        RemoteFooService('http://localhost:5001').foo(FooRequest(request_str='blah'))
+        self.assertEqual(2, mock_post.call_count)
+        self.assertIs(apilib.get_default_http_transport(), apilib.get_default_http_transport())
+        self.assertIsNone(mock_post.call_args[1]['timeout'])
+
+    def test_transport(self):
+        transport = apilib.HttpTransport(pool_maxsize=20, max_retries=3, timeout=5)
+        adapter = transport.session.get_adapter('https://localhost')
+        self.assertEqual(20, adapter._pool_maxsize)
+        self.assertEqual(3, adapter.max_retries.total)
+
+        with mock.patch.object(transport.session, 'post') as mock_post:
+            mock_post.return_value = MockJsonResponse(200, {'response_str': 'this is a response', 'response_code': 'SUCCESS'})
+            service = RemoteFooService('http://localhost:5000', transport=transport)
+            foo_response = service.foo(FooRequest(request_str='blah'))
+        self.assertEqual('this is a response', foo_response.response_str)
+        self.assertEqual('http://localhost:5000/foo_service/foo', mock_post.call_args[0][0])
+        self.assertEqual(5, mock_post.call_args[1]['timeout'])
+
+    def test_transport_rejects_cookies(self):
+        class CookieHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                body = json.dumps({'response_str': self.headers.get('Cookie'), 'response_code': 'SUCCESS'}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Set-Cookie', 'session=secret; Path=/')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), CookieHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        transport = apilib.HttpTransport()
+        try:
+            url = 'http://127.0.0.1:%d' % server.server_address[1]
+            RemoteFooService(url, transport=transport).foo(FooRequest(request_str='blah'))
+            foo_response = RemoteFooService(url, transport=transport).foo(FooRequest(request_str='blah'))
+        finally:
+            transport.close()
+            server.shutdown()
+            server.server_close()
+        self.assertEqual('SUCCESS', foo_response.response_code)
+        self.assertIsNone(foo_response.response_str)
+        self.assertEqual(0, len(transport.session.cookies))
+
     def test_unknown_method(self):
         service = RemoteFooService('http://localhost:5000')
         with self.assertRaises(apilib.MethodNotFoundException) as context:
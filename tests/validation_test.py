@@ -3,6 +3,8 @@ from __future__ import absolute_import
 import datetime
 import unittest
 
+import mock
+
 from dateutil import parser as dateutil_parser
 from dateutil import tz
 
@@ -884,5 +886,251 @@ class TestValidatorErrorFieldPaths(unittest.TestCase):
         self.assertEqual('dchild["foo"].fstring', errors[0].path)
 
 
+class ErrorContextTest(unittest.TestCase):
+    def test_error_counts_propagate_to_ancestors(self):
+        ec = apilib.ErrorContext()
+        child = ec.extend(field='foo')
+        grandchild = child.extend(index=2)
+        sibling = ec.extend(field='bar')
+        self.assertFalse(ec.has_errors())
+
+        grandchild.add_error('CODE', 'message')
+        self.assertTrue(grandchild.has_errors())
+        self.assertTrue(child.has_errors())
+        self.assertTrue(ec.has_errors())
+        self.assertFalse(sibling.has_errors())
+        self.assertEqual(1, ec.error_count)
+
+        sibling.add_error('CODE', 'message')
+        ec.add_error('ROOT', 'message')
+        self.assertEqual(3, ec.error_count)
+        self.assertEqual(1, child.error_count)
+        self.assertEqual(['root', 'foo[2]', 'bar'], [e.path or 'root' for e in ec.all_errors()])
+        self.assertEqual(['foo[2]'], [e.path for e in child.all_errors()])
+
+    def test_children_without_errors_not_retained(self):
+        ec = apilib.ErrorContext()
+        ec.extend(field='foo').extend(index=0)
+        ec.extend(field='bar').extend(key='baz')
+        self.assertEqual([], ec.children)
+
+        ec.extend(field='bar').extend(key='baz').add_error('CODE', 'message')
+        self.assertEqual(1, len(ec.children))
+        self.assertEqual(1, len(ec.children[0].children))
+        self.assertEqual('bar["baz"]', ec.children[0].children[0].path)
+
+    def test_paths(self):
+        ec = apilib.ErrorContext()
+        self.assertEqual('', ec.path)
+        self.assertEqual('foo', ec.extend(field='foo').path)
+        self.assertEqual('foo[1].bar["x"]', ec.extend(field='foo').extend(index=1).extend(field='bar').extend(key='x').path)
+        self.assertEqual('[3]', ec.extend(index=3).path)
+        self.assertEqual('prefix.foo', apilib.ErrorContext('prefix').extend(field='foo').path)
+        with self.assertRaises(TypeError):
+            ec.extend()
+
+class ErrorLimitTest(unittest.TestCase):
+    class Model(apilib.Model):
+        lint = apilib.Field(apilib.ListType(apilib.Integer()))
+        lchild = apilib.Field(apilib.ListType(SimpleRequiredChild))
+
+    def test_from_json_stops_at_limit(self):
+        obj = {'lint': ['x'] * 1000, 'lchild': [{}] * 1000}
+        with self.assertRaises(apilib.DeserializationError) as e:
+            self.Model.from_json(obj)
+        self.assertEqual(1000, len(e.exception.errors))
+
+        with self.assertRaises(apilib.DeserializationError) as e:
+            self.Model.from_json(obj, max_errors=3)
+        self.assertEqual(['lint[0]', 'lint[1]', 'lint[2]'], [error.path for error in e.exception.errors])
+
+    def test_limit_applies_to_validation(self):
+        obj = {'lchild': [{}] * 1000}
+        ec = apilib.ErrorContext(max_errors=2)
+        m = self.Model.from_json(obj, ec, apilib.ValidationContext())
+        self.assertIsNone(m)
+        self.assertEqual(['lchild[0].fstring', 'lchild[1].fstring'], [error.path for error in ec.all_errors()])
+
+        m = TestRequiredNumericFields.Model()
+        with self.assertRaises(apilib.exceptions.ValidationError) as e:
+            m.validate(context=apilib.ValidationContext(), max_errors=1)
+        self.assertEqual(1, len(e.exception.errors))
+
+    def test_error_context_raises_at_limit(self):
+        ec = apilib.ErrorContext(max_errors=2)
+        ec.extend(field='a').add_error('CODE', 'message')
+        with self.assertRaises(apilib.ErrorLimitReached) as e:
+            ec.extend(field='b').add_error('CODE', 'message')
+        self.assertIs(ec, e.exception.error_context)
+        self.assertEqual(2, len(ec.all_errors()))
+
+class UnserializableChild(apilib.Model):
+    fstring = apilib.Field(apilib.String())
+
+    def to_json(self):
+        raise AssertionError('Should not be serialized during validation')
+
+class LazyParentContextTest(unittest.TestCase):
+    class Model(apilib.Model):
+        foo = apilib.Field(apilib.String(), validators=[apilib.ExactlyOneNonempty('foo', 'bar')])
+        bar = apilib.Field(apilib.String(), validators=[apilib.ExactlyOneNonempty('foo', 'bar')])
+        lchild = apilib.Field(apilib.ListType(UnserializableChild))
+
+    class ChildOperation(apilib.Operation):
+        fstring = apilib.Field(apilib.String(), required='mutate/ADD')
+        fchild = apilib.Field(apilib.ModelType(UnserializableChild))
+
+    def test_only_read_fields_serialized(self):
+        m = self.Model(foo='a', lchild=[UnserializableChild(fstring='b')])
+        self.assertIs(m, m.validate(apilib.ErrorContext(), apilib.ValidationContext()))
+
+        m = self.Model(foo='a', bar='b', lchild=[UnserializableChild(fstring='b')])
+        ec = apilib.ErrorContext()
+        self.assertIsNone(m.validate(ec, apilib.ValidationContext()))
+        self.assertEqual(['foo', 'bar'], sorted([e.path for e in ec.all_errors()], reverse=True))
+
+    def test_operator_read_from_parent(self):
+        m = self.ChildOperation(operator='ADD', fchild=UnserializableChild())
+        ec = apilib.ErrorContext()
+        self.assertIsNone(m.validate(ec, apilib.ValidationContext(method='mutate')))
+        self.assertEqual(['fstring'], [e.path for e in ec.all_errors()])
+
+        m = self.ChildOperation(operator='UPDATE', fchild=UnserializableChild())
+        self.assertIs(m, m.validate(apilib.ErrorContext(), apilib.ValidationContext(method='mutate')))
+
+    def test_parent_view(self):
+        m = self.Model(foo='a', bar=None)
+        parent = apilib.model._LazyModelDict(m)
+        self.assertEqual({'foo': u'a', 'bar': None}, dict(parent))
+        self.assertEqual(2, len(parent))
+        self.assertIsNone(parent.get('lchild'))
+        with self.assertRaises(KeyError):
+            parent['lchild']
+
+
+class ContextRecordingString(apilib.String):
+    def __init__(self):
+        self.contexts = []
+
+    def from_json(self, value, error_context, context=None):
+        self.contexts.append(context)
+        return super(ContextRecordingString, self).from_json(value, error_context, context)
+
+class ValidatorFreeChild(apilib.Model):
+    fstring = apilib.Field(apilib.String())
+
+class SkippedValidationTest(unittest.TestCase):
+    class Parent(apilib.Model):
+        fstring = apilib.Field(apilib.String(), required=True)
+        lchild = apilib.Field(apilib.ListType(ValidatorFreeChild))
+
+    class CustomTypeParent(apilib.Model):
+        frecorded = apilib.Field(ContextRecordingString())
+
+    def test_validator_free_subtree_not_given_context(self):
+        with mock.patch.object(ValidatorFreeChild, 'make_parent_context') as make_parent_context:
+            m = self.Parent.from_json({'fstring': 'a', 'lchild': [{'fstring': 'b'}]}, apilib.ErrorContext(), apilib.ValidationContext())
+            self.assertEqual('b', m.lchild[0].fstring)
+            m.validate(apilib.ErrorContext(), apilib.ValidationContext())
+        self.assertFalse(make_parent_context.called)
+
+        ec = apilib.ErrorContext()
+        self.assertIsNone(self.Parent.from_json({'lchild': []}, ec, apilib.ValidationContext()))
+        self.assertEqual(['fstring'], [e.path for e in ec.all_errors()])
+
+    def test_validated_fields(self):
+        self.assertEqual(['fstring'], [name for name, field in self.Parent._get_validated_fields()])
+        self.assertEqual([], ValidatorFreeChild._get_validated_fields())
+        self.assertTrue(self.Parent._requires_context())
+        self.assertFalse(ValidatorFreeChild._requires_context())
+
+    def test_custom_field_type_still_given_context(self):
+        self.CustomTypeParent.from_json({'frecorded': 'a'}, apilib.ErrorContext(), apilib.ValidationContext(method='get'))
+        contexts = self.CustomTypeParent.frecorded.get_type().contexts
+        self.assertEqual(1, len(contexts))
+        self.assertEqual('get', contexts[0].method)
+        self.assertTrue(self.CustomTypeParent._requires_context())
+
+
+class ActiveValidatorsTest(unittest.TestCase):
+    class Model(apilib.Model):
+        fmutate = apilib.Field(apilib.String(), required='mutate')
+        fupdate = apilib.Field(apilib.String(), readonly='mutate/UPDATE')
+        fnonempty = apilib.Field(apilib.ListType(apilib.String()), validators=[apilib.NonemptyElements()])
+
+    class Op(apilib.Operation):
+        fstring = apilib.Field(apilib.String(), required='mutate/ADD')
+
+    def test_active_validators_cached_per_context(self):
+        with mock.patch.object(apilib.MethodMatcher, 'matches', autospec=True, side_effect=apilib.MethodMatcher.matches) as matches:
+            for _ in range(3):
+                self.Model.from_json({'fupdate': 'a'}, apilib.ErrorContext(), apilib.ValidationContext(service='S', method='get'))
+            self.assertEqual(2, matches.call_count)
+
+        active = self.Model._get_active_validators(apilib.ValidationContext(service='S', method='get'))
+        self.assertEqual({'fnonempty'}, set(active))
+        active = self.Model._get_active_validators(apilib.ValidationContext(service='S', method='mutate', operator='UPDATE'))
+        self.assertEqual({'fmutate', 'fupdate', 'fnonempty'}, set(active))
+
+    def test_validation_uses_active_validators(self):
+        m = self.Model.from_json({'fupdate': 'a'}, apilib.ErrorContext(), apilib.ValidationContext(method='get'))
+        self.assertEqual('a', m.fupdate)
+
+        ec = apilib.ErrorContext()
+        self.assertIsNone(self.Model.from_json({'fupdate': 'a'}, ec, apilib.ValidationContext(method='mutate', operator='UPDATE')))
+        self.assertEqual(['fmutate'], [e.path for e in ec.all_errors()])
+
+        m = self.Model(fmutate='a', fupdate='b')
+        self.assertIs(m, m.validate(apilib.ErrorContext(), apilib.ValidationContext(method='mutate', operator='UPDATE')))
+        ec = apilib.ErrorContext()
+        self.assertIsNone(self.Model().validate(ec, apilib.ValidationContext(method='mutate')))
+        self.assertEqual(['fmutate'], [e.path for e in ec.all_errors()])
+
+    def test_operator_from_parent(self):
+        ec = apilib.ErrorContext()
+        self.assertIsNone(self.Op.from_json({'operator': 'ADD'}, ec, apilib.ValidationContext(method='mutate')))
+        self.assertEqual(['fstring'], [e.path for e in ec.all_errors()])
+        self.assertIsNotNone(self.Op.from_json({'operator': 'UPDATE'}, apilib.ErrorContext(), apilib.ValidationContext(method='mutate')))
+
+    def test_unknown_operators_evicted(self):
+        class Op(apilib.Operation):
+            fstring = apilib.Field(apilib.String(), required='mutate/ADD')
+        for i in range(apilib.model.MAX_CACHED_VALIDATOR_CONTEXTS + 50):
+            Op.from_json({'operator': 'JUNK%d' % i, 'fstring': 'a'}, apilib.ErrorContext(), apilib.ValidationContext(service='s', method='mutate'))
+        ec = apilib.ErrorContext()
+        self.assertIsNone(Op.from_json({'operator': 'ADD'}, ec, apilib.ValidationContext(service='s', method='mutate')))
+        self.assertEqual(['fstring'], [e.path for e in ec.all_errors()])
+        self.assertIn(('s', 'mutate', 'ADD'), Op._active_validators_cache)
+        self.assertEqual(apilib.model.MAX_CACHED_VALIDATOR_CONTEXTS, len(Op._active_validators_cache))
+
+    def test_unhashable_operator(self):
+        ec = apilib.ErrorContext()
+        self.assertIsNone(self.Op.from_json({'operator': ['ADD']}, ec, apilib.ValidationContext(method='mutate')))
+        self.assertEqual(['operator'], [e.path for e in ec.all_errors()])
+
+
+class MethodMatcherTest(unittest.TestCase):
+    def test_matches(self):
+        matcher = apilib.MethodMatcher(['get', 'mutate/ADD', 'FooService.delete', 'BarService.mutate/UPDATE'])
+        self.assertTrue(matcher.matches('AnyService', 'get', None))
+        self.assertTrue(matcher.matches('AnyService', 'get', 'UPDATE'))
+        self.assertTrue(matcher.matches(None, 'get', None))
+        self.assertTrue(matcher.matches('AnyService', 'mutate', 'ADD'))
+        self.assertFalse(matcher.matches('AnyService', 'mutate', 'UPDATE'))
+        self.assertFalse(matcher.matches('AnyService', 'mutate', None))
+        self.assertTrue(matcher.matches('FooService', 'delete', 'ADD'))
+        self.assertFalse(matcher.matches('BarService', 'delete', None))
+        self.assertTrue(matcher.matches('BarService', 'mutate', 'UPDATE'))
+        self.assertFalse(matcher.matches('FooService', 'mutate', 'UPDATE'))
+        self.assertFalse(matcher.matches(None, None, None))
+        self.assertTrue(matcher.matches('AnyService', 'get', ['ADD']))
+        self.assertFalse(matcher.matches('AnyService', 'mutate', ['ADD']))
+
+    def test_all(self):
+        matcher = apilib.MethodMatcher(True)
+        self.assertTrue(matcher.matches(None, None, None))
+        self.assertTrue(matcher.matches('FooService', 'get', 'ADD'))
+
+
 if __name__ == '__main__':
     unittest.main()